@@ -0,0 +1,57 @@
+"""
+Registry of attachment handlers. A handler takes a parsed attachment (see messages.py)
+and the chat context and returns the download jobs for it instead of downloading it,
+so every attachment type is queued and prioritized by the download pool the same way.
+"""
+
+
+# Priorities are counted in jobs: a job queued with priority N is overtaken
+# by at most N jobs queued after it, see DownloadPool.submit
+PRIORITY_HIGH   = 0
+PRIORITY_NORMAL = 16
+PRIORITY_LOW    = 64
+
+
+class DownloadJob:
+    """
+    url        - link to the file
+    filepath   - where the file is saved
+    priority   - lower values are downloaded first
+    size_hint  - expected size in bytes when the API returns it, smaller files go first
+    key        - identity of the attachment, see messages.attachment_key
+    fetcher    - queues the download itself when it is split into several pool jobs,
+                 fetcher.submit(download_pool, filepath, priority) -> Future (see video_download.py).
+                 By default the url is downloaded by one pool job
+    fallback   - job queued instead when the fetcher finds the file unavailable
+                 (video_download.VideoUnavailable), e.g. the preview of a video.
+                 A job without url records `filepath` that is already saved
+    """
+    __slots__ = ('key', 'url', 'filepath', 'priority', 'size_hint', 'fetcher', 'fallback')
+
+    def __init__(self, key, url, filepath, priority = PRIORITY_NORMAL, size_hint = None, fetcher = None,
+                 fallback = None):
+        self.key       = key
+        self.url       = url
+        self.filepath  = filepath
+        self.priority  = priority
+        self.size_hint = size_hint
+        self.fetcher   = fetcher
+        self.fallback  = fallback
+
+
+ATTACHMENT_HANDLERS = {}
+
+
+def attachment_handler(attach_type):
+    """
+    Registers the decorated function as the handler of `attach_type`:
+    handler(attachment, ctx) -> list of DownloadJob
+    """
+    def register(handler):
+        ATTACHMENT_HANDLERS[attach_type] = handler
+        return handler
+    return register
+
+
+def get_attachment_handler(attach_type):
+    return ATTACHMENT_HANDLERS.get(attach_type)
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import shutil
+import threading
+
+from concurrent.futures import Future
+
+
+BLOB_STORE_FOLDER_NAME = ".blobs"
+
+LINK_MODES = ('hardlink', 'symlink')
+
+
+class BlobStore:
+    """
+    Content-addressed storage for attachments shared between conversations.
+
+    Every attachment is saved once under a name derived from its identity key,
+    chat folders get hardlinks (or symlinks) to the stored blob.
+    """
+
+    def __init__(self, folder, link_mode = 'hardlink'):
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"unknown blob link mode: {link_mode}, expected one of {LINK_MODES}")
+        self.folder    = folder
+        self.link_mode = link_mode
+        self.lock      = threading.Lock()
+        # blobs that are being downloaded, blob path -> future
+        self.pending   = {}
+
+    def get_blob_path(self, key, extension):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, digest[:2], digest + extension)
+
+    def store(self, key, filepath, submit):
+        """
+        Links the blob of `key` to `filepath`, `submit(blob_path)` queues the download
+        of the blob and returns its future, it is called only when the blob is neither
+        stored nor being downloaded.
+        Returns a future that is resolved once the link is created.
+        """
+        blob_path = self.get_blob_path(key, os.path.splitext(filepath)[1])
+        result = Future()
+        result.set_running_or_notify_cancel()
+
+        need_fetch = False
+        with self.lock:
+            if os.path.isfile(blob_path):
+                self._link_to_result(blob_path, filepath, result)
+                return result
+
+            pending = self.pending.get(blob_path)
+            if pending is None:
+                pending = Future()
+                pending.set_running_or_notify_cancel()
+                self.pending[blob_path] = pending
+                need_fetch = True
+
+        # submit may block on a full queue, so it is called without holding the lock
+        if need_fetch:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            submit(blob_path).add_done_callback(
+                lambda f: self._finish_pending(blob_path, f)
+            )
+
+        def on_fetched(f):
+            if f.exception() is not None:
+                result.set_exception(f.exception())
+            else:
+                self._link_to_result(blob_path, filepath, result)
+
+        pending.add_done_callback(on_fetched)
+        return result
+
+    def _finish_pending(self, blob_path, fetched):
+        with self.lock:
+            pending = self.pending.pop(blob_path)
+        if fetched.exception() is not None:
+            pending.set_exception(fetched.exception())
+        else:
+            pending.set_result(None)
+
+    def _link_to_result(self, blob_path, filepath, result):
+        try:
+            link_file(blob_path, filepath, self.link_mode)
+            result.set_result(None)
+        except Exception as e:
+            result.set_exception(e)
+
+
+def link_file(source_filepath, filepath, link_mode = 'hardlink'):
+    """
+    Falls back to a plain copy when the file system does not support links
+    """
+    if os.path.lexists(filepath):
+        os.remove(filepath)
+    try:
+        if link_mode == 'symlink':
+            relative_path = os.path.relpath(source_filepath, os.path.dirname(filepath))
+            os.symlink(relative_path, filepath)
+        else:
+            os.link(source_filepath, filepath)
+    except (OSError, NotImplementedError):
+        shutil.copyfile(source_filepath, filepath)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+
+from vk_api import utils
+
+
+def make_message(message_id, depth=2):
+    """ Сообщение, похожее на ответ messages.getHistory: фотографии
+        со всеми размерами и вложенные пересланные сообщения
+    """
+
+    return {
+        'id': message_id,
+        'date': 1600000000 + message_id,
+        'from_id': 183433824,
+        'peer_id': 2000000001,
+        'text': 'Привет, это сообщение номер %s' % message_id,
+        'attachments': [
+            {
+                'type': 'photo',
+                'photo': {
+                    'id': message_id,
+                    'owner_id': 183433824,
+                    'sizes': [
+                        {
+                            'type': size_type,
+                            'url': 'https://sun9-1.userapi.com/c%s/%s.jpg' % (message_id, size_type),
+                            'width': 100 * (i + 1),
+                            'height': 75 * (i + 1)
+                        }
+                        for i, size_type in enumerate('smxyzw')
+                    ]
+                }
+            }
+        ],
+        'fwd_messages': [
+            make_message(message_id * 10 + i, depth - 1) for i in range(2)
+        ] if depth else []
+    }
+
+
+def main():
+    """ Сравнение скорости разбора страницы messages.getHistory (200 сообщений)
+        библиотеками JSON, доступными в vk_api.utils
+    """
+
+    page = json.dumps({
+        'response': {
+            'count': 100000,
+            'items': [make_message(i) for i in range(200)]
+        }
+    }, ensure_ascii=False).encode('utf-8')
+
+    print('page size: %.1f KB' % (len(page) / 1024))
+
+    repeat = 50
+    default_backend = utils.get_json_backend()
+
+    for name, module in utils.JSON_BACKENDS.items():
+        if module is None:
+            print('%-8s not installed' % name)
+            continue
+
+        utils.set_json_backend(name)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            utils.json_loads(page)
+        elapsed = (time.perf_counter() - start) / repeat
+
+        print('%-8s %.2f ms per page' % (name, elapsed * 1000))
+
+    utils.set_json_backend(default_backend)
+
+
+if __name__ == '__main__':
+    main()
@@ -35,6 +35,9 @@ setup(
     extras_require={
         'vkstreaming': ['websocket-client'],
         'vkaudio': ['beautifulsoup4'],
+        'vkasync': ['aiohttp'],
+        'vkfastjson': ['orjson'],
+        'vkstream': ['ijson'],
     },
     classifiers=[
         'License :: OSI Approved :: Apache Software License',
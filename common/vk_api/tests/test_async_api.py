@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from vk_api import ApiError
+from vk_api.async_api import AsyncVkApi, AsyncVkTools
+
+
+class FakeResponse(object):
+    status = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    async def json(self, loads=None, content_type=None):
+        return self.data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeSession(object):
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def post(self, url, data=None):
+        self.requests.append((url, data))
+        return FakeResponse(self.responses.pop(0))
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_async_method():
+    session = FakeSession([
+        {'error': {'error_code': 6, 'error_msg': 'Too many requests per second'}},
+        {'response': [{'id': 1}]},
+        {'error': {'error_code': 5, 'error_msg': 'User authorization failed'}},
+    ])
+
+    async def main():
+        vk = AsyncVkApi(token='token', session=session).get_api()
+
+        assert await vk.users.get(user_ids=1) == [{'id': 1}]
+
+        with pytest.raises(ApiError):
+            await vk.users.get(user_ids=1)
+
+    run(main())
+
+    assert session.requests[0][0] == 'https://api.vk.com/method/users.get'
+    assert session.requests[0][1]['access_token'] == 'token'
+
+
+def test_async_need_validation_handler():
+    session = FakeSession([
+        {'error': {'error_code': 17, 'error_msg': 'Validation required'}},
+        {'error': {'error_code': 17, 'error_msg': 'Validation required'}},
+    ])
+
+    class ValidatingVkApi(AsyncVkApi):
+        async def need_validation_handler(self, error):
+            return {'validated': error.code}
+
+    async def main():
+        assert await ValidatingVkApi(token='token', session=session).method('users.get') == {'validated': 17}
+
+        with pytest.raises(ApiError):
+            await AsyncVkApi(token='token', session=session).method('users.get')
+
+    run(main())
+
+
+@pytest.mark.parametrize('prefetch', [0, 1])
+def test_async_get_all_iter(prefetch):
+    session = FakeSession([
+        {'response': {'count': 3, 'items': [1, 2], 'offset': 2, 'more': True}},
+        {'response': {'count': 3, 'items': [3], 'offset': 3, 'more': False}},
+    ])
+
+    async def main():
+        tools = AsyncVkTools(AsyncVkApi(token='token', session=session))
+        return [i async for i in tools.get_all_iter('wall.get', 2, prefetch=prefetch)]
+
+    assert run(main()) == [1, 2, 3]
+    assert 'API.wall.get' in session.requests[0][1]['code']
@@ -0,0 +1,73 @@
+from vk_api.cache import VkApiCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_ttl_and_lru():
+    clock = FakeClock()
+    cache = VkApiCache(ttls={'users.get': 10}, max_size=2, clock=clock)
+
+    assert not cache.is_cacheable('messages.send')
+
+    cache.set('users.get', {'user_ids': 1}, [{'id': 1}])
+    cache.set('users.get', {'user_ids': 2}, [{'id': 2}])
+
+    assert cache.get('users.get', {'user_ids': 1}) == (True, [{'id': 1}])
+
+    # user_ids=2 давно не использовался и удаляется при переполнении
+    cache.set('users.get', {'user_ids': 3}, [{'id': 3}])
+    assert cache.get('users.get', {'user_ids': 2}) == (False, None)
+
+    clock.now += 10
+    assert cache.get('users.get', {'user_ids': 1}) == (False, None)
+
+    assert cache.stats == {'hits': 1, 'misses': 2, 'evictions': 1}
+
+
+def test_cache_invalidate_and_persist(tmp_path):
+    filename = str(tmp_path / 'cache.json')
+    cache = VkApiCache(filename=filename)
+
+    cache.set('users.get', {'user_ids': 1}, [{'id': 1}])
+    cache.set('groups.getById', {'group_id': 1}, [{'id': 1}])
+    cache.save()
+
+    cache.invalidate('users.get')
+    assert cache.get('users.get', {'user_ids': 1}) == (False, None)
+    assert cache.get('groups.getById', {'group_id': 1})[0]
+
+    loaded = VkApiCache(filename=filename)
+    assert loaded.get('users.get', {'user_ids': 1}) == (True, [{'id': 1}])
+
+
+def test_vk_api_cache(mocker):
+    import json
+
+    import vk_api
+
+    vk_session = vk_api.VkApi(token='token', cache=VkApiCache())
+
+    response = mocker.Mock(ok=True, status_code=200)
+    response.content = json.dumps({'response': [{'id': 1}]}).encode()
+    post = mocker.patch.object(vk_session.http, 'post', return_value=response)
+
+    vk = vk_session.get_api()
+
+    assert vk.users.get(user_ids=1) == [{'id': 1}]
+    assert vk.users.get(user_ids=1) == [{'id': 1}]
+    assert post.call_count == 1
+
+    vk.users.get(user_ids=2)
+    vk.messages.markAsRead(peer_id=1)
+    vk.messages.markAsRead(peer_id=1)
+    assert post.call_count == 4
+
+    vk_session.cache.invalidate()
+    vk.users.get(user_ids=1)
+    assert post.call_count == 5
@@ -0,0 +1,84 @@
+from vk_api.rate_limiter import VkRateLimiter
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rate_limiter_burst():
+    clock = FakeClock()
+    limiter = VkRateLimiter(rps=2, burst=3, clock=clock)
+
+    assert [limiter.reserve() for _ in range(5)] == [0, 0, 0, 0.5, 1.0]
+
+    clock.now = 10.0
+    assert limiter.reserve() == 0
+
+
+def test_rate_limiter_tokens():
+    limiter = VkRateLimiter(rps=1, clock=FakeClock())
+
+    assert limiter.reserve(token='a') == 0
+    assert limiter.reserve(token='b') == 0
+    assert limiter.reserve(token='a') == 1.0
+
+
+def test_rate_limiter_method_limits():
+    limiter = VkRateLimiter(
+        rps=10, burst=10,
+        method_limits={'messages.send': (1, 1)},
+        clock=FakeClock()
+    )
+
+    assert limiter.reserve('messages.send') == 0
+    assert limiter.reserve('messages.send') == 1.0
+    assert limiter.reserve('users.get') == 0
+
+
+def test_rate_limiter_adaptive():
+    limiter = VkRateLimiter(rps=2, min_rps=0.5, adaptive=True, clock=FakeClock())
+
+    limiter.throttle()
+    assert limiter.get_rps() == 1.0
+
+    limiter.throttle()
+    limiter.throttle()
+    assert limiter.get_rps() == 0.5
+
+    for _ in range(100):
+        limiter.relax()
+
+    assert limiter.get_rps() == 2
+    assert limiter.stats['throttled'] == 3
+
+
+def test_too_many_rps_retry_budget(mocker):
+    import json
+
+    import vk_api
+    from vk_api.exceptions import ApiError, TOO_MANY_RPS_CODE
+
+    vk_session = vk_api.VkApi(token='token')
+    vk_session.RPS_RETRY_LIMIT = 3
+
+    response = mocker.Mock(ok=True, content=json.dumps({
+        'error': {'error_code': TOO_MANY_RPS_CODE, 'error_msg': 'Too many'}
+    }).encode())
+    post = mocker.patch.object(vk_session.http, 'post', return_value=response)
+    mocker.patch('vk_api.vk_api.time.sleep')
+
+    try:
+        vk_session.method('users.get')
+    except ApiError as e:
+        assert e.code == TOO_MANY_RPS_CODE
+    else:
+        assert False, 'ApiError was not raised'
+
+    assert post.call_count == 4
+    assert vk_session.stats['retries'] == 3
+    assert vk_session.stats['retry_budget_exhausted'] == 1
+    assert vk_session.rate_limiter.get_rps('token') < 1 / vk_session.RPS_DELAY
@@ -26,3 +26,41 @@ def test_requests_pool_one_param(vk):
     assert isinstance(users, dict)
     assert users['durov'][0]['city']['id'] == 2
     assert users['python273'][0]['id'] == 183433824
+
+
+def test_auto_batching(mocker):
+    import json
+    import threading
+
+    from jconfig.memory import MemoryConfig
+    from vk_api import ApiError, VkApi
+
+    vk = VkApi(token='token', config=MemoryConfig)
+    vk.enable_auto_batching(window=0.1)
+
+    execute_response = {
+        'response': [[{'id': 1}], False, [{'id': 3}]],
+        'execute_errors': [{'method': 'users.get', 'error_code': 113, 'error_msg': 'Invalid user id'}]
+    }
+    post = mocker.patch.object(vk.http, 'post')
+    post.return_value.ok = True
+    post.return_value.content = json.dumps(execute_response).encode()
+
+    results = {}
+
+    def call(user_id):
+        try:
+            results[user_id] = vk.method('users.get', {'user_ids': user_id})
+        except ApiError as e:
+            results[user_id] = e.code
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in (1, 2, 3)]
+    for thread in threads:
+        thread.start()
+        thread.join(0.01)
+    for thread in threads:
+        thread.join()
+
+    assert post.call_count == 1
+    assert post.call_args[0][0] == 'https://api.vk.com/method/execute'
+    assert results == {1: [{'id': 1}], 2: 113, 3: [{'id': 3}]}
@@ -0,0 +1,114 @@
+import pytest
+import requests
+
+from vk_api.exceptions import VkCircuitOpen
+from vk_api.retry import VkRetryPolicy
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.now += delay
+
+
+class FakeResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+
+def make_policy(**kwargs):
+    clock = FakeClock()
+    return VkRetryPolicy(clock=clock, sleep=clock.sleep, **kwargs), clock
+
+
+def test_retry_statuses():
+    policy, _ = make_policy(max_attempts=5)
+    responses = iter([FakeResponse(502), FakeResponse(503), FakeResponse(200)])
+
+    response = policy.call(lambda: next(responses), 'https://api.vk.com/method/users.get')
+
+    assert response.status_code == 200
+    assert policy.stats['retries'] == 2
+
+
+def test_retry_idempotency():
+    policy, _ = make_policy(max_attempts=5)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise requests.exceptions.ReadTimeout()
+
+    assert policy.is_idempotent('messages.getHistory')
+    assert not policy.is_idempotent('messages.send')
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        policy.call(fail, 'https://api.vk.com/method/messages.send', idempotent=False)
+
+    assert len(calls) == 1
+
+
+def test_retry_deadline():
+    policy, clock = make_policy(
+        max_attempts=100, backoff_max=10, deadline=30, breaker_threshold=100
+    )
+
+    response = policy.call(lambda: FakeResponse(500), 'https://api.vk.com/')
+
+    assert response.status_code == 500
+    assert clock.now <= 30
+    assert policy.stats['gave_up'] == 1
+
+
+def test_circuit_breaker():
+    policy, clock = make_policy(
+        max_attempts=1, breaker_threshold=2, breaker_timeout=10, deadline=5
+    )
+
+    for _ in range(2):
+        policy.call(lambda: FakeResponse(500), 'https://sun9-1.userapi.com/a.jpg')
+
+    # хост отключен дольше, чем deadline запроса
+    with pytest.raises(VkCircuitOpen):
+        policy.call(lambda: FakeResponse(200), 'https://sun9-1.userapi.com/b.jpg')
+
+    # другие хосты не затронуты
+    assert policy.call(lambda: FakeResponse(200), 'https://api.vk.com/').status_code == 200
+
+    clock.now += 10
+    assert policy.call(
+        lambda: FakeResponse(200), 'https://sun9-1.userapi.com/b.jpg'
+    ).status_code == 200
+
+
+def test_circuit_breaker_counts_calls():
+    policy, clock = make_policy(
+        max_attempts=6, breaker_threshold=5, breaker_timeout=30, deadline=300
+    )
+
+    # повторы одного запроса не отключают хост
+    with pytest.raises(requests.exceptions.ConnectionError):
+        policy.call(fail_connection, 'https://api.vk.com/method/users.get')
+
+    assert policy.stats['retries'] == 5
+    assert policy.call(lambda: FakeResponse(200), 'https://api.vk.com/').status_code == 200
+
+    for _ in range(5):
+        policy.call(lambda: FakeResponse(500), 'https://api.vk.com/')
+
+    # запрос к отключенному хосту ждет пробного запроса, а не завершается ошибкой
+    opened_at = clock.now
+    assert policy.call(lambda: FakeResponse(200), 'https://api.vk.com/').status_code == 200
+    assert clock.now >= opened_at + 30
+    assert policy.stats['waited'] >= 1
+    assert policy.stats['rejected'] == 0
+
+
+def fail_connection():
+    raise requests.exceptions.ConnectionError()
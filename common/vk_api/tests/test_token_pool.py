@@ -0,0 +1,41 @@
+import pytest
+
+from jconfig.memory import MemoryConfig
+from vk_api import ApiError, VkTokenPool
+from vk_api.exceptions import VkTokenPoolException
+
+
+def make_error(vk, code):
+    return ApiError(vk, 'users.get', {}, False, {'error_code': code, 'error_msg': ''})
+
+
+def test_token_pool_round_robin(mocker):
+    pool = VkTokenPool(['a', 'b'], strategy='round_robin', config=MemoryConfig)
+    for member in pool.members:
+        mocker.patch.object(member.vk_session, 'method', return_value=member.vk_session.token['access_token'])
+
+    vk = pool.get_api()
+    assert [vk.users.get() for _ in range(4)] == ['a', 'b', 'a', 'b']
+
+
+def test_token_pool_evicts_tokens(mocker):
+    pool = VkTokenPool(['a', 'b', 'c'], config=MemoryConfig)
+    a, b, c = (member.vk_session for member in pool.members)
+
+    mocker.patch.object(a, 'method', side_effect=make_error(a, 5))
+    mocker.patch.object(b, 'method', side_effect=make_error(b, 9))
+    mocker.patch.object(c, 'method', return_value='c')
+
+    assert pool.method('users.get') == 'c'
+    assert [s['healthy'] for s in pool.get_stats()] == [False, False, True]
+
+    mocker.patch.object(c, 'method', side_effect=make_error(c, 100))
+    with pytest.raises(ApiError):
+        pool.method('users.get')
+
+    mocker.patch.object(c, 'method', side_effect=make_error(c, 29))
+    with pytest.raises(ApiError):
+        pool.method('users.get')
+
+    with pytest.raises(VkTokenPoolException):
+        pool.method('users.get')
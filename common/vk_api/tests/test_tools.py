@@ -0,0 +1,101 @@
+import time
+
+import pytest
+
+from vk_api.tools import VkTools, prefetch_iter
+
+
+class FakeVk(object):
+    def __init__(self, count):
+        self.count = count
+        self.offsets = []
+
+    def method(self, method, values=None):
+        offset = values['offset']
+        self.offsets.append(offset)
+
+        return {
+            'count': self.count,
+            'items': list(range(offset, min(offset + values['count'], self.count)))
+        }
+
+
+@pytest.mark.parametrize('prefetch', [0, 1, 3])
+def test_get_all_slow_iter_prefetch(prefetch):
+    vk = FakeVk(95)
+    items = VkTools(vk).get_all_slow_iter('wall.get', 10, prefetch=prefetch)
+
+    assert list(items) == list(range(95))
+    assert vk.offsets == list(range(0, 100, 10))
+
+
+def test_get_all_iter_prefetch(mocker):
+    import vk_api
+
+    vk_session = vk_api.VkApi(token='token')
+    mocker.patch.object(vk_session, 'method', side_effect=[
+        {'response': {'count': 3, 'items': [1, 2], 'offset': 2, 'more': True}},
+        {'response': {'count': 3, 'items': [3], 'offset': 3, 'more': False}},
+    ])
+
+    items = VkTools(vk_session).get_all_iter('wall.get', 2, prefetch=2)
+
+    assert list(items) == [1, 2, 3]
+
+
+def test_prefetch_iter_bounded():
+    produced = []
+
+    def pages():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    items = prefetch_iter(pages(), depth=2)
+
+    assert next(items) == 0
+
+    # один элемент отдан, два в буфере, один ждет места в буфере
+    for _ in range(50):
+        if len(produced) >= 4:
+            break
+        time.sleep(0.01)
+
+    assert len(produced) == 4
+
+    items.close()
+
+
+def test_prefetch_iter_error():
+    def pages():
+        yield 1
+        raise ValueError('error')
+
+    items = prefetch_iter(pages())
+
+    assert next(items) == 1
+
+    with pytest.raises(ValueError):
+        next(items)
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_get_all_sharded_iter(mocker, ordered):
+    windows = []
+
+    def get_items_window(vk, method, key, values, offset, end):
+        windows.append((offset, end))
+        return {'response': {'count': 1234, key: list(range(offset, min(end, 1234)))}}
+
+    mocker.patch('vk_api.tools.vk_get_items_window', side_effect=get_items_window)
+
+    items = list(VkTools(FakeVk(1234)).get_all_sharded_iter(
+        'wall.get', 10, workers=3, ordered=ordered
+    ))
+
+    if ordered:
+        assert items == list(range(1234))
+    else:
+        assert sorted(items) == list(range(1234))
+
+    assert sorted(windows) == [(i, min(i + 250, 1234)) for i in range(0, 1234, 250)]
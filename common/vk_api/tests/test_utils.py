@@ -0,0 +1,106 @@
+import pytest
+
+from vk_api import utils
+
+
+@pytest.mark.parametrize('backend', [
+    name for name, module in utils.JSON_BACKENDS.items() if module is not None
+])
+def test_json_backend(backend):
+    default_backend = utils.get_json_backend()
+    utils.set_json_backend(backend)
+
+    try:
+        assert utils.json_loads(b'{"items": [{"id": 1, "text": "\xd0\xbf"}]}') == {
+            'items': [{'id': 1, 'text': 'п'}]
+        }
+        assert utils.json_loads('[]') == []
+
+        assert utils.sjson_dumps({'text': 'п/1', 'ids': [1, 2]}) == '{"text":"п/1","ids":[1,2]}'
+        assert utils.sjson_dumps({1: 2}) == '{"1":2}'
+    finally:
+        utils.set_json_backend(default_backend)
+
+
+@pytest.mark.parametrize('with_ijson', [True, False])
+def test_iter_json_items(monkeypatch, with_ijson):
+    import io
+
+    if with_ijson:
+        pytest.importorskip('ijson')
+    else:
+        monkeypatch.setattr(utils, 'ijson', None)
+
+    data = (
+        b'{"response": {"count": 3, "items": ['
+        b'{"id": 3, "attachments": [{"type": "photo"}]}, {"id": 2.5}, 1'
+        b'], "more": false}}'
+    )
+    document = {}
+
+    items = utils.iter_json_items(io.BytesIO(data), 'response.items', document)
+
+    assert next(items) == {'id': 3, 'attachments': [{'type': 'photo'}]}
+    assert list(items) == [{'id': 2.5}, 1]
+    assert document == {'response': {'count': 3, 'items': [], 'more': False}}
+
+
+def test_method_stream(mocker):
+    import io
+
+    import vk_api
+    from vk_api.exceptions import ApiError
+
+    vk_session = vk_api.VkApi(token='token')
+
+    def make_response(data):
+        response = mocker.MagicMock(ok=True, status_code=200)
+        response.raw = io.BytesIO(data)
+        response.__enter__.return_value = response
+        return response
+
+    post = mocker.patch.object(vk_session.http, 'post', return_value=make_response(
+        b'{"response": {"count": 2, "items": [{"id": 1}, {"id": 2}]}}'
+    ))
+
+    document = {}
+    items = vk_session.method_stream('wall.get', {'count': 2}, document=document)
+
+    assert post.call_args[1]['stream'] is True
+    assert list(items) == [{'id': 1}, {'id': 2}]
+    assert document['count'] == 2
+
+    post.return_value = make_response(
+        b'{"error": {"error_code": 15, "error_msg": "Access denied"}}'
+    )
+
+    with pytest.raises(ApiError):
+        list(vk_session.method_stream('wall.get'))
+
+
+def test_method_stream_read_error(mocker):
+    import io
+
+    import requests
+    from urllib3.exceptions import ProtocolError
+
+    import vk_api
+
+    vk_session = vk_api.VkApi(token='token')
+
+    class DroppedBody(io.BytesIO):
+        def read(self, *args):
+            data = super(DroppedBody, self).read(*args)
+            if not data:
+                raise ProtocolError('Connection broken: IncompleteRead')
+            return data
+
+    response = mocker.MagicMock(ok=True, status_code=200)
+    response.raw = DroppedBody(b'{"response": {"count": 2, "items": [{"id": 1}, {"id"')
+    response.__enter__.return_value = response
+    mocker.patch.object(vk_session.http, 'post', return_value=response)
+
+    items = vk_session.method_stream('wall.get')
+
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        list(items)
@@ -5,9 +5,13 @@
 
 :copyright: (c) 2019 python273
 """
+from .cache import VkApiCache
 from .enums import *
 from .exceptions import *
-from .requests_pool import VkRequestsPool, vk_request_one_param_pool
+from .rate_limiter import VkRateLimiter
+from .requests_pool import VkAutoBatcher, VkRequestsPool, vk_request_one_param_pool
+from .retry import VkRetryPolicy
+from .token_pool import VkTokenPool
 from .tools import VkTools
 from .upload import VkUpload
 from .vk_api import VkApi, VkApiGroup
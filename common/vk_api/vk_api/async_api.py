@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+"""
+:authors: python273
+:license: Apache License, Version 2.0, see LICENSE file
+
+:copyright: (c) 2019 python273
+"""
+
+import asyncio
+import contextvars
+import inspect
+import logging
+import random
+
+import aiohttp
+
+from .exceptions import *
+from .execute import parse_args
+from .rate_limiter import VkRateLimiter
+from .tools import vk_get_all_items
+from .utils import json_loads
+from .vk_api import DEFAULT_USERAGENT, VkApiMethod
+
+
+class AsyncVkApi(object):
+    """ Асинхронный клиент API на aiohttp
+
+    Авторизация по логину и паролю не поддерживается, нужен готовый
+    access_token (например, полученный через :class:`VkApi`)
+
+    :param token: access_token
+    :type token: str
+
+    :param captcha_handler: Функция для обработки капчи, см. :func:`captcha_handler`.
+        Может быть корутиной
+    :param api_version: Версия API
+    :type api_version: str
+
+    :param session: Кастомная сессия со своими параметрами. Если не передана,
+        создается при первом запросе и закрывается в :meth:`close`
+    :type session: :class:`aiohttp.ClientSession`
+
+    :param rate_limiter: Ограничитель частоты запросов. Можно передать тот же
+        объект, что используется в :class:`VkApi`, чтобы синхронные и
+        асинхронные запросы делили одно ограничение
+    :type rate_limiter: :class:`vk_api.rate_limiter.VkRateLimiter`
+
+    >>> async with AsyncVkApi(token='...') as vk_session:
+    ...     vk = vk_session.get_api()
+    ...     await vk.users.get(user_ids=1)
+    """
+
+    RPS_DELAY = 0.34  # ~3 requests per second
+
+    RPS_RETRY_LIMIT = 5
+    RPS_BACKOFF_BASE = 0.5
+    RPS_BACKOFF_MAX = 8.0
+
+    def __init__(self, token=None, captcha_handler=None, api_version='5.92',
+                 session=None, rate_limiter=None):
+
+        self.token = {'access_token': token}
+        self.api_version = api_version
+
+        self.http = session
+        self._own_session = session is None
+
+        self.rate_limiter = rate_limiter or VkRateLimiter(
+            rps=1 / self.RPS_DELAY, adaptive=True
+        )
+
+        self.stats = {
+            'too_many_rps': 0,
+            'flood_control': 0,
+            'retries': 0,
+            'retry_budget_exhausted': 0,
+        }
+        self._rps_retries = contextvars.ContextVar('rps_retries', default=0)
+
+        self.error_handlers = {
+            NEED_VALIDATION_CODE: self.need_validation_handler,
+            CAPTCHA_ERROR_CODE: captcha_handler or self.captcha_handler,
+            TOO_MANY_RPS_CODE: self.too_many_rps_handler
+        }
+
+        self.logger = logging.getLogger('vk_api')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        """ Закрывает сессию, если она была создана автоматически """
+
+        if self._own_session and self.http is not None:
+            await self.http.close()
+            self.http = None
+
+    def _get_http(self):
+        if self.http is None:
+            self.http = aiohttp.ClientSession(
+                headers={'User-agent': DEFAULT_USERAGENT}
+            )
+
+        return self.http
+
+    def captcha_handler(self, captcha):
+        """ Обработчик капчи (http://vk.com/dev/captcha_error)
+
+        :param captcha: объект исключения `Captcha`
+        """
+
+        raise captcha
+
+    def need_validation_handler(self, error):
+        """ Обработчик проверки безопасности при запросе API
+            (http://vk.com/dev/need_validation), см.
+            :meth:`vk_api.vk_api.VkApi.need_validation_handler`
+
+        По умолчанию ничего не делает, и ошибка выбрасывается как
+        :class:`ApiError`. Может быть корутиной; ответ, отличный от None,
+        возвращается как результат запроса
+
+        :param error: исключение
+        """
+
+        pass
+
+    def http_handler(self, error):
+        """ Обработчик ошибок соединения
+
+        :param error: исключение
+        """
+
+        pass
+
+    async def too_many_rps_handler(self, error):
+        """ Обработчик ошибки "Слишком много запросов в секунду",
+            см. :meth:`vk_api.vk_api.VkApi.too_many_rps_handler`
+
+        :param error: исключение
+        """
+
+        attempt = self._rps_retries.get()
+
+        if attempt >= self.RPS_RETRY_LIMIT:
+            self.stats['retry_budget_exhausted'] += 1
+            raise error
+
+        delay = min(self.RPS_BACKOFF_MAX, self.RPS_BACKOFF_BASE * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)
+
+        self.logger.warning(f'Too many requests! Sleeping {delay:.2f} sec...')
+
+        self.stats['retries'] += 1
+        await asyncio.sleep(delay)
+
+        reset_token = self._rps_retries.set(attempt + 1)
+        try:
+            return await error.try_method()
+        finally:
+            self._rps_retries.reset(reset_token)
+
+    def get_api(self):
+        """ Возвращает VkApiMethod(self)
+
+            Вызовы методов возвращают корутины:
+            `await vk.wall.get(...)`
+        """
+
+        return VkApiMethod(self)
+
+    async def _call_handler(self, handler, error):
+        response = handler(error)
+
+        if inspect.isawaitable(response):
+            response = await response
+
+        return response
+
+    async def method(self, method, values=None, captcha_sid=None,
+                     captcha_key=None, raw=False):
+        """ Вызов метода API, см. :meth:`vk_api.vk_api.VkApi.method` """
+
+        values = values.copy() if values else {}
+
+        if 'v' not in values:
+            values['v'] = self.api_version
+
+        if self.token and self.token.get('access_token'):
+            values['access_token'] = self.token['access_token']
+
+        if captcha_sid and captcha_key:
+            values['captcha_sid'] = captcha_sid
+            values['captcha_key'] = captcha_key
+
+        delay = self.rate_limiter.reserve(method, values.get('access_token'))
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        async with self._get_http().post(
+                f'https://api.vk.com/method/{method}',
+                data={k: str(v) for k, v in values.items() if v is not None}) as response:
+
+            if response.status == 200:
+                response_json = await response.json(
+                    loads=json_loads, content_type=None
+                )
+            else:
+                error = ApiHttpError(self, method, values, raw, response)
+                response_json = await self._call_handler(self.http_handler, error)
+
+                if response_json is not None:
+                    return response_json
+
+                raise error
+
+        if 'error' in response_json:
+            error = ApiError(self, method, values, raw, response_json['error'])
+
+            if error.code in (TOO_MANY_RPS_CODE, FLOOD_CONTROL_CODE):
+                self.stats[
+                    'too_many_rps' if error.code == TOO_MANY_RPS_CODE
+                    else 'flood_control'
+                ] += 1
+                self.rate_limiter.throttle(values.get('access_token'))
+
+            if error.code in self.error_handlers:
+                if error.code == CAPTCHA_ERROR_CODE:
+                    error = Captcha(
+                        self,
+                        error.error['captcha_sid'],
+                        self.method,
+                        (method,),
+                        {'values': values, 'raw': raw},
+                        error.error['captcha_img']
+                    )
+
+                response = await self._call_handler(
+                    self.error_handlers[error.code], error
+                )
+
+                if response is not None:
+                    return response
+
+            raise error
+
+        self.rate_limiter.relax(values.get('access_token'))
+
+        return response_json if raw else response_json['response']
+
+    async def execute(self, function, *args, **kwargs):
+        """ Вызов :class:`vk_api.execute.VkFunction`
+
+        :param function: объект VkFunction
+        """
+
+        args = parse_args(function.args, args, kwargs)
+
+        return await self.method(
+            'execute',
+            {'code': function.compile(args)},
+            raw=function.return_raw
+        )
+
+
+_PREFETCH_END = object()
+
+
+async def prefetch_aiter(aiterable, depth=1):
+    """ Асинхронная версия :func:`vk_api.tools.prefetch_iter`: перебирает
+        `aiterable` в отдельной задаче, заранее получая до `depth` элементов
+    """
+
+    buffer = asyncio.Queue(maxsize=max(1, depth))
+
+    async def produce():
+        try:
+            async for item in aiterable:
+                await buffer.put((item, None))
+        except Exception as e:
+            await buffer.put((_PREFETCH_END, e))
+        else:
+            await buffer.put((_PREFETCH_END, None))
+
+    task = asyncio.ensure_future(produce())
+
+    try:
+        while True:
+            item, error = await buffer.get()
+
+            if item is _PREFETCH_END:
+                if error is not None:
+                    raise error
+                return
+
+            yield item
+    finally:
+        task.cancel()
+
+
+class AsyncVkTools(object):
+    """ Асинхронные версии методов :class:`vk_api.tools.VkTools`
+
+    :param vk: Объект :class:`AsyncVkApi`
+    """
+
+    __slots__ = ('vk',)
+
+    def __init__(self, vk):
+        self.vk = vk
+
+    async def get_all_iter(self, method, max_count, values=None, key='items',
+                           limit=None, stop_fn=None, negative_offset=False,
+                           prefetch=0):
+        """ Получить все элементы (асинхронный генератор).
+            Параметры см. :meth:`vk_api.tools.VkTools.get_all_iter`,
+            при `prefetch` следующие запросы выполняются в отдельной задаче
+
+        >>> async for item in tools.get_all_iter('wall.get', 100, {'owner_id': 1}):
+        ...     print(item)
+        """
+
+        pages = self._get_all_pages(
+            method, max_count, values, key, limit, stop_fn, negative_offset
+        )
+
+        if prefetch:
+            pages = prefetch_aiter(pages, prefetch)
+
+        async for items in pages:
+            for item in items:
+                yield item
+
+    async def _get_all_pages(self, method, max_count, values, key, limit,
+                             stop_fn, negative_offset):
+        values = values.copy() if values else {}
+        values['count'] = max_count
+
+        offset = max_count if negative_offset else 0
+        items_count = 0
+        count = None
+
+        while True:
+            response = await self.vk.execute(
+                vk_get_all_items, method, key, values, count, offset,
+                offset_mul=-1 if negative_offset else 1
+            )
+
+            if 'execute_errors' in response:
+                raise VkToolsException(
+                    f"Could not load items: {response['execute_errors']}",
+                    response=response,
+                )
+
+            response = response['response']
+
+            items = response["items"]
+            items_count += len(items)
+
+            yield items
+
+            if not response['more']:
+                break
+
+            if limit and items_count >= limit:
+                break
+
+            if stop_fn and stop_fn(items):
+                break
+
+            count = response['count']
+            offset = response['offset']
+
+    async def get_all(self, method, max_count, values=None, key='items',
+                      limit=None, stop_fn=None, negative_offset=False):
+        """ Использовать только если нужно загрузить все объекты в память """
+
+        items = [
+            item async for item in self.get_all_iter(
+                method, max_count, values, key, limit, stop_fn, negative_offset
+            )
+        ]
+
+        return {'count': len(items), key: items}
+
+    async def get_all_slow_iter(self, method, max_count, values=None,
+                                key='items', limit=None, stop_fn=None,
+                                negative_offset=False, prefetch=0):
+        """ Получить все элементы без использования execute
+            (асинхронный генератор).
+            Параметры см. :meth:`vk_api.tools.VkTools.get_all_slow_iter`
+        """
+
+        pages = self._get_all_slow_pages(
+            method, max_count, values, key, limit, stop_fn, negative_offset
+        )
+
+        if prefetch:
+            pages = prefetch_aiter(pages, prefetch)
+
+        async for items in pages:
+            for item in items:
+                yield item
+
+    async def _get_all_slow_pages(self, method, max_count, values, key, limit,
+                                  stop_fn, negative_offset):
+        values = values.copy() if values else {}
+        values['count'] = max_count
+
+        offset_mul = -1 if negative_offset else 1
+
+        offset = max_count if negative_offset else 0
+        count = None
+
+        items_count = 0
+
+        while count is None or offset < count:
+            values['offset'] = offset * offset_mul
+            response = await self.vk.method(method, values)
+
+            new_count = response['count']
+
+            count_diff = (new_count - count) if count is not None else 0
+
+            if count_diff < 0:
+                offset += count_diff
+                count = new_count
+                continue
+
+            response_items = response[key]
+            items = response_items[count_diff:]
+            items_count += len(items)
+
+            yield items
+
+            if len(response_items) < max_count - count_diff:
+                break
+
+            if limit and items_count >= limit:
+                break
+
+            if stop_fn and stop_fn(items):
+                break
+
+            offset += max_count
+            count = new_count
+
+    async def get_all_slow(self, method, max_count, values=None, key='items',
+                           limit=None, stop_fn=None, negative_offset=False):
+        """ Использовать только если нужно загрузить все объекты в память """
+
+        items = [
+            item async for item in self.get_all_slow_iter(
+                method, max_count, values, key, limit, stop_fn, negative_offset
+            )
+        ]
+
+        return {'count': len(items), key: items}
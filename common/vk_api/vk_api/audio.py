@@ -15,7 +15,7 @@ from bs4 import BeautifulSoup
 
 from .audio_url_decoder import decode_audio_url
 from .exceptions import AccessDenied
-from .utils import set_cookies_from_list
+from .utils import json_loads, set_cookies_from_list
 from .upload import FilesOpener
 
 RE_ALBUM_ID = re.compile(r'act=audio_playlist(-?\d+)_(\d+)')
@@ -107,7 +107,7 @@ class VkAudio(object):
 
         offset = 0
         while True:
-            response = self._vk.http.post(
+            response = json_loads(self._vk.http.post(
                 'https://m.vk.com/audio',
                 data={
                     'act': 'load_section',
@@ -119,7 +119,7 @@ class VkAudio(object):
                     'is_loading_all': 1
                 },
                 allow_redirects=False
-            ).json()
+            ).content)
 
             if not response['data'][0]:
                 raise AccessDenied(
@@ -214,7 +214,7 @@ class VkAudio(object):
                 'q': q
             }
         )
-        json_response = json.loads(response.text.replace('<!--', ''))
+        json_response = json_loads(response.text.replace('<!--', ''))
 
         if not json_response['payload'][1]:
             raise AccessDenied(
@@ -264,7 +264,7 @@ class VkAudio(object):
                 'genre': genre
             }
         )
-        json_response = json.loads(response.text.replace('<!--', ''))
+        json_response = json_loads(response.text.replace('<!--', ''))
         return json_response["payload"][1][0]
 
     def upload_audio(self, audio: str, group_id: int = 0):
@@ -281,9 +281,9 @@ class VkAudio(object):
                 'gid': group_id
             }
         )
-        url = re.search("(https?:[^']*)", json.loads(response.text.replace('<!--', ''))["payload"][1][2]).group(0)
+        url = re.search("(https?:[^']*)", json_loads(response.text.replace('<!--', ''))["payload"][1][2]).group(0)
         with FilesOpener(audio, key_format='file') as f:
-            uploader_response = self._vk.http.post(url, files=f).json()
+            uploader_response = json_loads(self._vk.http.post(url, files=f).content)
         response = self._vk.http.post(
             'https://vk.com/al_audio.php',
             data={
@@ -293,7 +293,7 @@ class VkAudio(object):
                 'upldr': 1
             }
         )
-        return json.loads(response.text.replace('<!--', ''))["payload"][1][0]
+        return json_loads(response.text.replace('<!--', ''))["payload"][1][0]
 
     def search(self, q, count=100, offset=0):
         """ Искать аудиозаписи
@@ -326,7 +326,7 @@ class VkAudio(object):
             }
         )
 
-        json_response = json.loads(response.text.replace('<!--', ''))
+        json_response = json_loads(response.text.replace('<!--', ''))
 
         while json_response['payload'][1][1]['playlist']:
 
@@ -357,7 +357,7 @@ class VkAudio(object):
                     'start_from': json_response['payload'][1][1]['nextFrom']
                 }
             )
-            json_response = json.loads(response.text.replace('<!--', ''))
+            json_response = json_loads(response.text.replace('<!--', ''))
 
     def get_updates_iter(self):
         """ Искать обновления друзей (генератор) """
@@ -373,7 +373,7 @@ class VkAudio(object):
                 'section': 'updates'
             }
         )
-        json_response = json.loads(response.text.replace('<!--', ''))
+        json_response = json_loads(response.text.replace('<!--', ''))
 
         while True:
             updates = [i['list'] for i in json_response['payload'][1][1]['playlists']]
@@ -402,7 +402,7 @@ class VkAudio(object):
                     'start_from': json_response['payload'][1][1]['nextFrom']
                 }
             )
-            json_response = json.loads(response.text.replace('<!--', ''))
+            json_response = json_loads(response.text.replace('<!--', ''))
 
     def get_popular_iter(self, offset=0):
         """ Искать популярные аудиозаписи  (генератор)
@@ -417,7 +417,7 @@ class VkAudio(object):
                 'section': 'recoms'
             }
         )
-        json_response = json.loads(scrap_json(response.text))
+        json_response = json_loads(scrap_json(response.text))
 
         ids = scrap_ids(
             json_response['sectionData']['recoms']['playlist']['list']
@@ -445,7 +445,7 @@ class VkAudio(object):
                 'section': 'recoms'
             }
         )
-        json_response = json.loads(scrap_json(response.text))
+        json_response = json_loads(scrap_json(response.text))
 
         ids = scrap_ids(
             json_response['sectionData']['recoms']['playlist']['list']
@@ -471,7 +471,7 @@ class VkAudio(object):
                 }
             )
 
-            json_response = json.loads(response.text.replace('<!--', ''))
+            json_response = json_loads(response.text.replace('<!--', ''))
 
             ids = scrap_ids(
                 json_response['payload'][1][1]['playlist']['list']
@@ -551,7 +551,7 @@ class VkAudio(object):
                 'hash': user_hash,
             }
         )
-        return json.loads(response.text.replace('<!--', ''))
+        return json_loads(response.text.replace('<!--', ''))
     
     def unfollow_user(self, user_id):
         data = self._vk.http.get(f"https://vk.com/audios{user_id}")
@@ -570,7 +570,7 @@ class VkAudio(object):
                 'hash': user_hash,
             }
         )
-        return json.loads(response.text.replace('<!--', ''))
+        return json_loads(response.text.replace('<!--', ''))
 
 
 def scrap_ids(audio_data):
@@ -618,7 +618,7 @@ def scrap_ids_from_html(html, filter_root_el=None):
         if 'audio_item_disabled' in audio['class']:
             continue
 
-        data_audio = json.loads(audio['data-audio'])
+        data_audio = json_loads(audio['data-audio'])
         audio_hashes = data_audio[13].split("/")
 
         full_id = (
@@ -641,10 +641,10 @@ def scrap_tracks(ids, user_id, http, convert_m3u8_links=True):
         if delay > 0:
             time.sleep(delay)
 
-        result = http.post(
+        result = json_loads(http.post(
             'https://m.vk.com/audio',
             data={'act': 'reload_audio', 'ids': ','.join(['_'.join(i) for i in ids_group])}
-        ).json()
+        ).content)
 
         last_request = time.time()
         if result['data']:
@@ -9,6 +9,8 @@ from enum import Enum
 
 import requests
 
+from .utils import json_loads
+
 CHAT_START_ID = int(2E9)
 
 
@@ -252,11 +254,11 @@ class VkBotLongPoll(object):
             'wait': self.wait,
         }
 
-        response = self.session.get(
+        response = json_loads(self.session.get(
             self.url,
             params=values,
             timeout=self.wait + 10
-        ).json()
+        ).content)
 
         if 'failed' not in response:
             self.ts = response['ts']
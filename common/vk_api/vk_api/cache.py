@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+:authors: python273
+:license: Apache License, Version 2.0, see LICENSE file
+
+:copyright: (c) 2019 python273
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha1
+
+from .utils import sjson_dumps
+
+#: Методы, которые только читают данные, и время жизни их ответов в секундах
+DEFAULT_TTLS = {
+    'users.get': 3600,
+    'groups.getById': 3600,
+    'messages.getConversationsById': 60,
+    'messages.getById': 60,
+    'utils.resolveScreenName': 24 * 3600,
+}
+
+
+class VkApiCache(object):
+    """ Кэш ответов API для методов, которые только читают данные
+
+    Хранит ответы не дольше времени жизни, заданного для метода,
+    и не больше `max_size` записей (при переполнении удаляются
+    давно не использованные). Ответы разных токенов хранятся отдельно.
+
+    Возвращаемые объекты общие для всех вызовов - их нельзя изменять
+
+    :param ttls: время жизни ответов в секундах для каждого метода,
+        кэшируются только перечисленные методы. По умолчанию `DEFAULT_TTLS`
+    :type ttls: dict
+
+    :param max_size: максимальное количество записей
+    :type max_size: int
+
+    :param filename: файл для сохранения кэша между запусками
+        (см. :meth:`save`). Если файл существует, кэш загружается из него
+    :type filename: str
+
+    :param clock: функция, возвращающая текущее время в секундах
+
+    >>> vk_session = VkApi(token='...', cache=VkApiCache())
+    >>> vk_session.method('users.get', {'user_ids': 1})  # запрос к API
+    >>> vk_session.method('users.get', {'user_ids': 1})  # из кэша
+    """
+
+    __slots__ = (
+        'ttls', 'max_size', 'filename', 'clock', 'entries', 'stats', 'lock'
+    )
+
+    def __init__(self, ttls=None, max_size=10000, filename=None,
+                 clock=time.time):
+        self.ttls = DEFAULT_TTLS.copy() if ttls is None else dict(ttls)
+        self.max_size = max_size
+        self.filename = filename
+        self.clock = clock
+
+        #: key -> (method, expires, response), от давно использованных к недавним
+        self.entries = OrderedDict()
+
+        #: Счетчики: hits - ответы из кэша, misses - запросы к API,
+        #: evictions - записи, удаленные при переполнении
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+        self.lock = threading.Lock()
+
+        if filename and os.path.isfile(filename):
+            self.load()
+
+    def is_cacheable(self, method):
+        return method in self.ttls
+
+    @staticmethod
+    def get_key(method, values):
+        return sha1(
+            sjson_dumps([method, sorted(values.items())]).encode('utf-8')
+        ).hexdigest()
+
+    def get(self, method, values):
+        """ Ответ из кэша
+
+        :returns: (найден ли ответ, ответ)
+        :rtype: tuple
+        """
+
+        key = self.get_key(method, values)
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or entry[1] <= self.clock():
+                if entry is not None:
+                    del self.entries[key]
+
+                self.stats['misses'] += 1
+                return False, None
+
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+
+            return True, entry[2]
+
+    def set(self, method, values, response):
+        key = self.get_key(method, values)
+        expires = self.clock() + self.ttls[method]
+
+        with self.lock:
+            self.entries[key] = (method, expires, response)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def get_or_call(self, method, values, call):
+        """ Возвращает ответ из кэша или результат `call()`,
+            который сохраняется в кэш
+        """
+
+        found, response = self.get(method, values)
+
+        if not found:
+            response = call()
+            self.set(method, values, response)
+
+        return response
+
+    def invalidate(self, method=None, values=None):
+        """ Удалить записи из кэша
+
+        :param method: метод, записи которого нужно удалить.
+            Если не указан - очищается весь кэш
+        :type method: str
+
+        :param values: параметры запроса (вместе с access_token и v),
+            чтобы удалить только одну запись
+        :type values: dict
+        """
+
+        with self.lock:
+            if method is None:
+                self.entries.clear()
+            elif values is not None:
+                self.entries.pop(self.get_key(method, values), None)
+            else:
+                for key in [k for k, v in self.entries.items() if v[0] == method]:
+                    del self.entries[key]
+
+    def save(self, filename=None):
+        """ Сохранить кэш в файл (устаревшие записи не сохраняются) """
+
+        filename = filename or self.filename
+        now = self.clock()
+
+        with self.lock:
+            entries = [
+                [key, method, expires, response]
+                for key, (method, expires, response) in self.entries.items()
+                if expires > now
+            ]
+
+        tmp_filename = filename + '.tmp'
+
+        with open(tmp_filename, 'w', encoding='utf-8') as f:
+            f.write(sjson_dumps(entries))
+
+        os.replace(tmp_filename, filename)
+
+    def load(self, filename=None):
+        """ Загрузить кэш из файла """
+
+        filename = filename or self.filename
+
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (IOError, ValueError):
+            return
+
+        now = self.clock()
+
+        with self.lock:
+            for key, method, expires, response in entries:
+                if expires > now and method in self.ttls:
+                    self.entries[key] = (method, expires, response)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
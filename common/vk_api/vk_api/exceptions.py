@@ -10,6 +10,7 @@
 TWOFACTOR_CODE = -2
 HTTP_ERROR_CODE = -1
 TOO_MANY_RPS_CODE = 6
+FLOOD_CONTROL_CODE = 9
 CAPTCHA_ERROR_CODE = 14
 NEED_VALIDATION_CODE = 17
 
@@ -101,7 +102,13 @@ class ApiHttpError(VkApiError):
         return self.vk.method(self.method, self.values, raw=self.raw)
 
     def __str__(self):
-        return f'Response code {self.response.status_code}'
+        # requests.Response или aiohttp.ClientResponse
+        status = getattr(self.response, 'status_code', None)
+
+        if status is None:
+            status = getattr(self.response, 'status', None)
+
+        return f'Response code {status}'
 
 
 class Captcha(VkApiError):
@@ -175,3 +182,16 @@ class VkRequestsPoolException(Exception):
     def __init__(self, error, *args, **kwargs):
         self.error = error
         super(VkRequestsPoolException, self).__init__(*args, **kwargs)
+
+
+class VkTokenPoolException(VkApiError):
+    pass
+
+
+class VkCircuitOpen(VkApiError):
+    def __init__(self, host):
+        super(VkCircuitOpen, self).__init__()
+        self.host = host
+
+    def __str__(self):
+        return f'Host {self.host} is temporarily disabled after repeated errors'
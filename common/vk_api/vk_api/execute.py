@@ -6,6 +6,7 @@
 :copyright: (c) 2019 python273
 """
 
+from .token_pool import VkTokenPool
 from .utils import sjson_dumps
 from .vk_api import VkApi, VkApiMethod
 
@@ -43,14 +44,14 @@ class VkFunction(object):
 
     def __call__(self, vk, *args, **kwargs):
         """
-        :param vk: VkApi или VkApiMethod
+        :param vk: VkApi, VkTokenPool или VkApiMethod
         :param *args:
         :param **kwargs:
         """
 
-        if not isinstance(vk, (VkApi, VkApiMethod)):
+        if not isinstance(vk, (VkApi, VkTokenPool, VkApiMethod)):
             raise TypeError(
-                'The first arg should be VkApi or VkApiMethod instance'
+                'The first arg should be VkApi, VkTokenPool or VkApiMethod instance'
             )
 
         if isinstance(vk, VkApiMethod):
@@ -64,6 +65,27 @@ class VkFunction(object):
             raw=self.return_raw
         )
 
+    def stream(self, vk, *args, path='items', document=None, **kwargs):
+        """ Вызов функции с потоковым разбором ответа,
+            см. :meth:`vk_api.vk_api.VkApi.method_stream`
+
+        :param vk: VkApi или VkApiMethod
+        :param path: путь к массиву в результате функции
+        :param document: словарь для остальных полей результата
+        """
+
+        if isinstance(vk, VkApiMethod):
+            vk = vk._vk
+
+        args = parse_args(self.args, args, kwargs)
+
+        return vk.method_stream(
+            'execute',
+            {'code': self.compile(args)},
+            path=path,
+            document=document
+        )
+
 
 def minify(code):
     return ''.join(i.strip() for i in code.splitlines())
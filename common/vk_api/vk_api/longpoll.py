@@ -12,6 +12,8 @@ from enum import IntEnum
 
 import requests
 
+from .utils import json_loads
+
 CHAT_START_ID = int(2E9)  # id с которого начинаются беседы
 
 
@@ -548,11 +550,11 @@ class VkLongPoll(object):
             'version': 3
         }
 
-        response = self.session.get(
+        response = json_loads(self.session.get(
             self.url,
             params=values,
             timeout=self.wait + 10
-        ).json()
+        ).content)
 
         if 'failed' not in response:
             self.ts = response['ts']
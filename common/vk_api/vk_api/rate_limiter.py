@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+:authors: python273
+:license: Apache License, Version 2.0, see LICENSE file
+
+:copyright: (c) 2019 python273
+"""
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """ Token bucket: пополняется на `rate` токенов в секунду,
+    накапливает не больше `burst` токенов
+
+    Токены можно брать в долг: :meth:`reserve` сразу резервирует слот и
+    возвращает время, которое нужно подождать до его наступления
+
+    :param rate: количество токенов в секунду
+    :type rate: float
+
+    :param burst: максимальное количество накопленных токенов
+    :type burst: int
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'timestamp')
+
+    def __init__(self, rate, burst=1, now=0.0):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.timestamp = now
+
+    def reserve(self, now):
+        """ Резервирует один токен
+
+        :param now: текущее время
+        :type now: float
+
+        :returns: время ожидания в секундах до использования токена
+        :rtype: float
+        """
+
+        self.tokens = min(
+            float(self.burst),
+            self.tokens + (now - self.timestamp) * self.rate
+        )
+        self.timestamp = now
+        self.tokens -= 1
+
+        if self.tokens >= 0:
+            return 0.0
+
+        return -self.tokens / self.rate
+
+
+class VkRateLimiter(object):
+    """ Ограничитель частоты запросов к API
+
+    Для каждого токена ведется отдельный бюджет запросов, дополнительно
+    можно ограничить частоту вызова отдельных методов.
+
+    Слот для запроса резервируется под блокировкой, а ожидание и сам запрос
+    выполняются без нее, поэтому несколько запросов могут выполняться
+    одновременно, не превышая ограничение.
+
+    :param rps: количество запросов в секунду для одного токена
+    :type rps: float
+
+    :param burst: сколько запросов можно отправить сразу после простоя
+    :type burst: int
+
+    :param method_limits: ограничения для отдельных методов
+        в виде `{'messages.send': (rps, burst)}`
+    :type method_limits: dict
+
+    :param clock: функция, возвращающая текущее время в секундах
+
+    :param adaptive: подстраивать частоту запросов токена (AIMD):
+        при ошибках "Слишком много запросов" (:meth:`throttle`) частота
+        уменьшается в `decrease_factor` раз, после успешных запросов
+        (:meth:`relax`) увеличивается на `increase_step`, но не выше `rps`
+    :type adaptive: bool
+
+    :param min_rps: минимальная частота запросов в адаптивном режиме
+    :type min_rps: float
+
+    :param decrease_factor: во сколько раз уменьшать частоту
+    :type decrease_factor: float
+
+    :param increase_step: на сколько увеличивать частоту
+    :type increase_step: float
+    """
+
+    __slots__ = (
+        'rps', 'burst', 'method_limits', 'clock', 'buckets', 'lock',
+        'adaptive', 'min_rps', 'decrease_factor', 'increase_step', 'stats'
+    )
+
+    def __init__(self, rps=3, burst=1, method_limits=None, clock=time.monotonic,
+                 adaptive=False, min_rps=0.5, decrease_factor=0.5,
+                 increase_step=0.05):
+        self.rps = rps
+        self.burst = burst
+        self.method_limits = method_limits or {}
+        self.clock = clock
+
+        self.adaptive = adaptive
+        self.min_rps = min(min_rps, rps)
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+
+        #: Счетчики: throttled - количество снижений частоты,
+        #: relaxed - количество повышений
+        self.stats = {'throttled': 0, 'relaxed': 0}
+
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _get_bucket(self, key, rate, burst, now):
+        bucket = self.buckets.get(key)
+
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(rate, burst, now)
+
+        return bucket
+
+    def reserve(self, method=None, token=None):
+        """ Резервирует слот для запроса
+
+        :param method: название метода
+        :type method: str
+
+        :param token: access_token, от имени которого делается запрос
+        :type token: str
+
+        :returns: время ожидания в секундах до отправки запроса
+        :rtype: float
+        """
+
+        with self.lock:
+            now = self.clock()
+
+            delay = self._get_bucket(
+                token, self.rps, self.burst, now
+            ).reserve(now)
+
+            if method in self.method_limits:
+                rps, burst = self.method_limits[method]
+                method_delay = self._get_bucket(
+                    (token, method), rps, burst, now
+                ).reserve(now)
+
+                delay = max(delay, method_delay)
+
+        return delay
+
+    def wait(self, method=None, token=None):
+        """ Резервирует слот для запроса и ждет его наступления """
+
+        delay = self.reserve(method, token)
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def throttle(self, token=None):
+        """ Уменьшает частоту запросов токена (multiplicative decrease)
+
+        :param token: access_token
+        :type token: str
+        """
+
+        if not self.adaptive:
+            return
+
+        with self.lock:
+            now = self.clock()
+            bucket = self._get_bucket(token, self.rps, self.burst, now)
+            bucket.rate = max(self.min_rps, bucket.rate * self.decrease_factor)
+            self.stats['throttled'] += 1
+
+    def relax(self, token=None):
+        """ Увеличивает частоту запросов токена после успешного
+            запроса (additive increase)
+
+        :param token: access_token
+        :type token: str
+        """
+
+        if not self.adaptive:
+            return
+
+        with self.lock:
+            bucket = self.buckets.get(token)
+
+            if bucket is None or bucket.rate >= self.rps:
+                return
+
+            bucket.rate = min(float(self.rps), bucket.rate + self.increase_step)
+            self.stats['relaxed'] += 1
+
+    def get_rps(self, token=None):
+        """ Текущая частота запросов токена """
+
+        with self.lock:
+            bucket = self.buckets.get(token)
+
+        return self.rps if bucket is None else bucket.rate
@@ -6,9 +6,12 @@
 :copyright: (c) 2019 python273
 """
 
+import threading
+import time
 from collections import namedtuple
+from concurrent.futures import Future
 
-from .exceptions import VkRequestsPoolException
+from .exceptions import ApiError, VkRequestsPoolException
 from .execute import VkFunction
 from .utils import sjson_dumps
 
@@ -117,29 +120,129 @@ class VkRequestsPool(object):
         for i in range(0, len(self.pool), 25):
             cur_pool = self.pool[i:i + 25]
 
-            one_method = check_one_method(cur_pool)
-            if one_method:
-                value_list = [i.values for i in cur_pool]
+            for request, (response, error) in zip(cur_pool, execute_pool(self.vk_session, cur_pool)):
+                if error is None:
+                    request.result.result = response
+                else:
+                    request.result.error = error
+        self.pool = []
+
+
+class VkAutoBatcher(object):
+    """
+    Автоматически объединяет запросы к API из разных потоков в execute.
+
+    Запросы, сделанные в течение `window` секунд после первого запроса,
+    отправляются одним execute (не более `max_batch_size` запросов).
+    Каждый вызывающий поток получает свой результат, ошибки
+    из `execute_errors` выбрасываются как :class:`ApiError`.
+
+    Обычно включается через :meth:`vk_api.vk_api.VkApi.enable_auto_batching`
+
+    :param vk_session: Объект :class:`VkApi`
+
+    :param window: время ожидания других запросов в секундах
+    :type window: float
+
+    :param max_batch_size: максимальное количество запросов в execute (max: 25)
+    :type max_batch_size: int
+    """
+
+    __slots__ = ('vk_session', 'window', 'max_batch_size', 'pending', 'lock')
+
+    def __init__(self, vk_session, window=0.03, max_batch_size=25):
+        self.vk_session = vk_session
+        self.window = window
+        self.max_batch_size = min(max_batch_size, 25)
+
+        self.pending = []
+        self.lock = threading.Lock()
 
-                response_raw = vk_one_method(
-                    self.vk_session, one_method, value_list
-                )
+    def method(self, method, values=None):
+        """ Добавляет запрос в очередь и ждет его результата
+
+        :param method: метод
+        :type method: str
+
+        :param values: параметры
+        :type values: dict
+        """
+
+        request = PoolRequest(method, values or {}, Future())
+        batch = None
+        is_leader = False
+
+        with self.lock:
+            self.pending.append(request)
+
+            if len(self.pending) >= self.max_batch_size:
+                batch = self._take_pending()
+            elif len(self.pending) == 1:
+                is_leader = True
+
+        if is_leader:
+            # Первый запрос в очереди ждет остальные и отправляет execute
+            time.sleep(self.window)
+
+            with self.lock:
+                batch = self._take_pending()
+
+        if batch:
+            self._execute(batch)
+
+        return request.result.result()
+
+    def _take_pending(self):
+        batch = self.pending
+        self.pending = []
+        return batch
+
+    def _execute(self, batch):
+        try:
+            results = execute_pool(self.vk_session, batch)
+        except BaseException as e:
+            for request in batch:
+                request.result.set_exception(e)
+            return
+
+        for request, (response, error) in zip(batch, results):
+            if error is None:
+                request.result.set_result(response)
             else:
-                response_raw = vk_many_methods(self.vk_session, cur_pool)
+                request.result.set_exception(ApiError(
+                    self.vk_session, request.method, request.values, False, error
+                ))
 
-            response = response_raw['response']
-            response_errors = response_raw.get('execute_errors', [])
 
-            response_errors_iter = iter(response_errors)
+def execute_pool(vk_session, pool):
+    """ Выполняет до 25 запросов одним execute.
+        Возвращает список пар (результат, ошибка) в порядке запросов
 
-            for x, current_response in enumerate(response):
-                current_result = cur_pool[x].result
+    :param vk_session: объект VkApi
+    :param pool: список PoolRequest
+    """
 
-                if current_response is not False:
-                    current_result.result = current_response
-                else:
-                    current_result.error = next(response_errors_iter)
-        self.pool = []
+    one_method = check_one_method(pool)
+    if one_method:
+        value_list = [i.values for i in pool]
+
+        response_raw = vk_one_method(vk_session, one_method, value_list)
+    else:
+        response_raw = vk_many_methods(vk_session, pool)
+
+    response = response_raw['response']
+    response_errors = response_raw.get('execute_errors', [])
+
+    response_errors_iter = iter(response_errors)
+
+    results = []
+    for current_response in response:
+        if current_response is not False:
+            results.append((current_response, None))
+        else:
+            results.append((None, next(response_errors_iter)))
+
+    return results
 
 
 def check_one_method(pool):
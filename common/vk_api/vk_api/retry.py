@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+:authors: python273
+:license: Apache License, Version 2.0, see LICENSE file
+
+:copyright: (c) 2019 python273
+"""
+
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from .exceptions import VkCircuitOpen
+
+#: Префиксы методов API, которые только читают данные
+#: и могут безопасно повторяться
+IDEMPOTENT_PREFIXES = (
+    'get', 'search', 'is', 'check', 'resolve', 'lookup', 'validate'
+)
+
+#: Ошибки, после которых запрос стоит повторить
+RETRY_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitBreaker(object):
+    """ Размыкатель для одного хоста
+
+    После `failure_threshold` неудачных запросов подряд хост считается
+    недоступным на `reset_timeout` секунд, запросы к нему ждут, пока это
+    время не истечет. Затем пропускается один пробный запрос: при успехе
+    размыкатель замыкается, при ошибке снова размыкается
+
+    :param failure_threshold: количество запросов подряд, завершившихся
+        ошибкой после всех попыток. Повторы одного запроса не считаются
+    :type failure_threshold: int
+
+    :param reset_timeout: время в секундах до пробного запроса
+    :type reset_timeout: float
+    """
+
+    __slots__ = (
+        'failure_threshold', 'reset_timeout', 'failures', 'opened_at',
+        'probing'
+    )
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def allow(self, now):
+        if self.opened_at is None:
+            return True
+
+        if self.probing or now - self.opened_at < self.reset_timeout:
+            return False
+
+        self.probing = True
+        return True
+
+    def get_wait(self, now, probe_wait):
+        """ Сколько ждать до следующей проверки :meth:`allow` """
+
+        if self.probing:
+            return probe_wait
+
+        return max(0.0, self.opened_at + self.reset_timeout - now)
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self, now):
+        self.failures += 1
+        self.probing = False
+
+        if self.failures >= self.failure_threshold:
+            self.opened_at = now
+
+
+class VkRetryPolicy(object):
+    """ Политика повторов запросов при временных ошибках сети и сервера:
+    обрыв соединения, таймаут, HTTP 429 и 5xx
+
+    Задержка между попытками растет экспоненциально (со случайным
+    разбросом), для 429 и 503 учитывается заголовок Retry-After.
+    Общее время всех попыток ограничено `deadline`.
+
+    Неидемпотентные запросы (например, messages.send) повторяются только
+    если соединение не удалось установить, иначе запрос мог быть
+    выполнен дважды
+
+    Пока хост отключен размыкателем, запросы к нему ждут (в пределах
+    `deadline`), а не завершаются ошибкой сразу
+
+    :param max_attempts: максимальное количество попыток (1 - без повторов)
+    :type max_attempts: int
+
+    :param backoff_base: задержка перед первым повтором в секундах
+    :type backoff_base: float
+
+    :param backoff_max: максимальная задержка между попытками
+    :type backoff_max: float
+
+    :param deadline: максимальное общее время всех попыток в секундах
+    :type deadline: float
+
+    :param idempotent_methods: методы, которые можно повторять, помимо
+        определенных по названию (например, `execute` с кодом,
+        который только читает данные)
+    :type idempotent_methods: set
+
+    :param breaker_threshold: количество ошибок подряд, после которого
+        хост считается недоступным, см. :class:`CircuitBreaker`
+    :type breaker_threshold: int
+
+    :param breaker_timeout: на сколько секунд отключать хост
+    :type breaker_timeout: float
+
+    :param clock: функция, возвращающая текущее время в секундах
+    :param sleep: функция ожидания
+    """
+
+    __slots__ = (
+        'max_attempts', 'backoff_base', 'backoff_max', 'deadline',
+        'idempotent_methods', 'breaker_threshold', 'breaker_timeout',
+        'clock', 'sleep', 'breakers', 'stats', 'lock'
+    )
+
+    def __init__(self, max_attempts=5, backoff_base=0.5, backoff_max=30.0,
+                 deadline=300.0, idempotent_methods=None, breaker_threshold=5,
+                 breaker_timeout=30.0, clock=time.monotonic, sleep=time.sleep):
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.idempotent_methods = set(idempotent_methods or ())
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+        self.clock = clock
+        self.sleep = sleep
+
+        self.breakers = {}
+
+        #: Счетчики: retries - повторы, gave_up - запросы, завершившиеся
+        #: ошибкой после всех попыток, waited - ожидания отключенного хоста,
+        #: rejected - запросы, не дождавшиеся хоста до `deadline`
+        self.stats = {'retries': 0, 'gave_up': 0, 'waited': 0, 'rejected': 0}
+
+        self.lock = threading.Lock()
+
+    def is_idempotent(self, method):
+        """ Можно ли повторять вызов метода API
+
+        :param method: название метода
+        :type method: str
+        """
+
+        if method in self.idempotent_methods:
+            return True
+
+        name = method.rpartition('.')[2]
+        return name.startswith(IDEMPOTENT_PREFIXES)
+
+    def _get_breaker(self, host):
+        breaker = self.breakers.get(host)
+
+        if breaker is None:
+            breaker = self.breakers[host] = CircuitBreaker(
+                self.breaker_threshold, self.breaker_timeout
+            )
+
+        return breaker
+
+    def _get_delay(self, attempt, response):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)
+
+        retry_after = response is not None and response.headers.get('Retry-After')
+
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(self.backoff_max, float(retry_after)))
+
+        return delay
+
+    def _wait_allowed(self, breaker, host, started):
+        """ Ждет, пока хост не станет доступен
+
+        :returns: является ли запрос пробным
+        """
+
+        while True:
+            with self.lock:
+                now = self.clock()
+
+                if breaker.allow(now):
+                    return breaker.opened_at is not None
+
+                delay = breaker.get_wait(now, self.backoff_base)
+
+            if now + delay - started > self.deadline:
+                with self.lock:
+                    self.stats['rejected'] += 1
+                raise VkCircuitOpen(host)
+
+            with self.lock:
+                self.stats['waited'] += 1
+
+            self.sleep(delay)
+
+    def call(self, fn, url, idempotent=True):
+        """ Выполняет `fn()` с повторами
+
+        :param fn: функция, выполняющая запрос и возвращающая
+            :class:`requests.Response`. Может сама выбрасывать
+            :class:`requests.HTTPError` (например, через raise_for_status)
+        :param url: адрес запроса, по хосту выбирается размыкатель
+        :type url: str
+
+        :param idempotent: можно ли повторять запрос, если он мог
+            дойти до сервера
+        :type idempotent: bool
+
+        :returns: результат `fn()`. Ответ с кодом из `RETRY_STATUSES`
+            возвращается, если попытки закончились
+        """
+
+        host = urlsplit(url).hostname
+        started = self.clock()
+        attempt = 0
+
+        with self.lock:
+            breaker = self._get_breaker(host)
+
+        while True:
+            probe = self._wait_allowed(breaker, host, started)
+
+            response = None
+            error = None
+
+            try:
+                response = fn()
+            except requests.exceptions.HTTPError as e:
+                if e.response is None or e.response.status_code not in RETRY_STATUSES:
+                    with self.lock:
+                        breaker.record_success()
+                    raise
+
+                error = e
+                response = e.response
+            except RETRY_EXCEPTIONS as e:
+                error = e
+            except BaseException:
+                if probe:
+                    with self.lock:
+                        breaker.probing = False
+                raise
+            else:
+                if getattr(response, 'status_code', None) not in RETRY_STATUSES:
+                    with self.lock:
+                        breaker.record_success()
+                    return response
+
+            if probe:
+                # пробный запрос не прошел - хост снова отключается
+                with self.lock:
+                    breaker.record_failure(self.clock())
+
+            attempt += 1
+            retryable = (
+                idempotent
+                or isinstance(error, requests.exceptions.ConnectTimeout)
+            )
+            delay = self._get_delay(attempt - 1, response)
+
+            if (not retryable or attempt >= self.max_attempts
+                    or self.clock() + delay - started > self.deadline):
+                with self.lock:
+                    self.stats['gave_up'] += 1
+
+                    # размыкатель считает запросы, а не отдельные попытки
+                    if breaker.opened_at is None:
+                        breaker.record_failure(self.clock())
+
+                if error is not None:
+                    raise error
+
+                return response
+
+            with self.lock:
+                self.stats['retries'] += 1
+
+            self.sleep(delay)
@@ -7,8 +7,8 @@
 """
 
 from .exceptions import VkApiError
+from .utils import json_loads
 import websocket
-import json
 
 
 class VkStreaming(object):
@@ -40,12 +40,12 @@ class VkStreaming(object):
 
     def get_rules(self):
         """ Получить список добавленных правил """
-        response = self.vk.http.get(self.URL_TEMPLATE.format(
+        response = json_loads(self.vk.http.get(self.URL_TEMPLATE.format(
             schema='https',
             server=self.server,
             method='rules',
             key=self.key)
-        ).json()
+        ).content)
 
         if response['code'] == 200:
             return response['rules'] or []
@@ -61,13 +61,13 @@ class VkStreaming(object):
         :param tag: Тег правила
         :type tag: str
         """
-        response = self.vk.http.post(self.URL_TEMPLATE.format(
+        response = json_loads(self.vk.http.post(self.URL_TEMPLATE.format(
             schema='https',
             server=self.server,
             method='rules',
             key=self.key),
             json={'rule': {'value': value, 'tag': tag}}
-        ).json()
+        ).content)
 
         if response['code'] == 200:
             return True
@@ -80,13 +80,13 @@ class VkStreaming(object):
         :param tag: Тег правила
         :type tag: str
         """
-        response = self.vk.http.delete(self.URL_TEMPLATE.format(
+        response = json_loads(self.vk.http.delete(self.URL_TEMPLATE.format(
             schema='https',
             server=self.server,
             method='rules',
             key=self.key),
             json={'tag': tag}
-        ).json()
+        ).content)
 
         if response['code'] == 200:
             return True
@@ -107,7 +107,7 @@ class VkStreaming(object):
         ))
 
         while True:
-            response = json.loads(ws.recv())
+            response = json_loads(ws.recv())
 
             if response['code'] == 100:
                 yield response['event']
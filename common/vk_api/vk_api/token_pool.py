@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+:authors: python273
+:license: Apache License, Version 2.0, see LICENSE file
+
+:copyright: (c) 2019 python273
+"""
+
+import itertools
+import threading
+import time
+
+from .exceptions import ApiError, FLOOD_CONTROL_CODE, VkTokenPoolException
+from .vk_api import VkApi, VkApiMethod
+
+AUTH_ERROR_CODE = 5
+RATE_LIMIT_REACHED_CODE = 29
+
+
+class TokenPoolMember(object):
+    """ Сессия из пула и ее состояние """
+
+    __slots__ = (
+        'vk_session', 'in_flight', 'requests', 'errors',
+        'disabled_until', 'last_used'
+    )
+
+    def __init__(self, vk_session):
+        self.vk_session = vk_session
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.disabled_until = 0.0
+        self.last_used = 0.0
+
+    def is_healthy(self, now):
+        return self.disabled_until <= now
+
+
+class VkTokenPool(object):
+    """ Распределяет запросы к API между несколькими токенами
+
+    У каждого токена своя сессия :class:`VkApi` со своим ограничением частоты
+    запросов, поэтому пропускная способность растет с количеством токенов.
+    Токены с ошибкой авторизации исключаются из пула, токены, получившие
+    flood control или rate limit, отключаются на `cooldown` секунд.
+    Запрос, завершившийся такой ошибкой, повторяется с другим токеном.
+
+    :param tokens: список access_token или объектов :class:`VkApi`
+    :type tokens: list
+
+    :param strategy: `least_loaded` - выбирается токен с наименьшим
+        количеством выполняющихся запросов, `round_robin` - по очереди
+    :type strategy: str
+
+    :param cooldown: на сколько секунд отключать токен после flood control
+    :type cooldown: float
+
+    :param vk_kwargs: параметры для создания :class:`VkApi` из токенов
+
+    >>> pool = VkTokenPool(['token1', 'token2'])
+    >>> vk = pool.get_api()
+    >>> vk.users.get(user_ids=1)
+    """
+
+    STRATEGIES = ('least_loaded', 'round_robin')
+
+    def __init__(self, tokens, strategy='least_loaded', cooldown=60.0,
+                 **vk_kwargs):
+
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f'Unknown strategy: {strategy}')
+
+        self.members = [
+            TokenPoolMember(
+                token if isinstance(token, VkApi) else VkApi(token=token, **vk_kwargs)
+            )
+            for token in tokens
+        ]
+
+        if not self.members:
+            raise ValueError('At least one token is required')
+
+        self.strategy = strategy
+        self.cooldown = cooldown
+
+        self._round_robin = itertools.cycle(range(len(self.members)))
+        self.lock = threading.Lock()
+
+    def _acquire(self, exclude):
+        with self.lock:
+            now = time.time()
+            candidates = [
+                member for member in self.members
+                if member not in exclude and member.is_healthy(now)
+            ]
+
+            if not candidates:
+                return None
+
+            if self.strategy == 'round_robin':
+                while True:
+                    member = self.members[next(self._round_robin)]
+                    if member in candidates:
+                        break
+            else:
+                member = min(
+                    candidates, key=lambda m: (m.in_flight, m.last_used)
+                )
+
+            member.in_flight += 1
+            member.requests += 1
+            member.last_used = now
+
+            return member
+
+    def _release(self, member, error=None):
+        with self.lock:
+            member.in_flight -= 1
+
+            if error is None:
+                return
+
+            member.errors += 1
+
+            if error.code == AUTH_ERROR_CODE:
+                member.disabled_until = float('inf')
+            elif error.code in (FLOOD_CONTROL_CODE, RATE_LIMIT_REACHED_CODE):
+                member.disabled_until = time.time() + self.cooldown
+
+    def method(self, method, values=None, **kwargs):
+        """ Вызов метода API с одним из токенов пула.
+            Параметры см. :meth:`vk_api.vk_api.VkApi.method`
+        """
+
+        tried = []
+        last_error = None
+
+        while True:
+            member = self._acquire(tried)
+
+            if member is None:
+                if last_error is not None:
+                    raise last_error
+
+                raise VkTokenPoolException('No available tokens in the pool')
+
+            tried.append(member)
+
+            try:
+                response = member.vk_session.method(method, values, **kwargs)
+            except ApiError as e:
+                self._release(member, e)
+
+                if e.code in (AUTH_ERROR_CODE, FLOOD_CONTROL_CODE,
+                              RATE_LIMIT_REACHED_CODE):
+                    last_error = e
+                    continue
+
+                raise
+            except BaseException:
+                self._release(member)
+                raise
+
+            self._release(member)
+            return response
+
+    def get_api(self):
+        """ Возвращает VkApiMethod(self) """
+
+        return VkApiMethod(self)
+
+    def get_stats(self):
+        """ Состояние токенов пула: количество запросов, ошибок
+            и доступен ли токен сейчас
+        """
+
+        with self.lock:
+            now = time.time()
+
+            return [
+                {
+                    'requests': member.requests,
+                    'errors': member.errors,
+                    'in_flight': member.in_flight,
+                    'healthy': member.is_healthy(now),
+                }
+                for member in self.members
+            ]
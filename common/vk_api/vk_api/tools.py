@@ -6,6 +6,11 @@
 :copyright: (c) 2019 python273
 """
 
+import queue
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 from .exceptions import ApiError, VkToolsException
 from .execute import VkFunction
 
@@ -23,7 +28,8 @@ class VkTools(object):
         self.vk = vk
 
     def get_all_iter(self, method, max_count, values=None, key='items',
-                     limit=None, stop_fn=None, negative_offset=False):
+                     limit=None, stop_fn=None, negative_offset=False,
+                     prefetch=0):
         """ Получить все элементы.
 
         Работает в методах, где в ответе есть count и items или users.
@@ -51,8 +57,26 @@ class VkTools(object):
 
         :param negative_offset: True если offset должен быть отрицательный
         :type negative_offset: bool
+
+        :param prefetch: сколько следующих запросов выполнять заранее
+                         в фоновом потоке, пока обрабатываются текущие
+                         элементы (0 - без упреждающей загрузки).
+                         stop_fn в этом случае вызывается из фонового потока
+        :type prefetch: int
         """
 
+        pages = self._get_all_pages(
+            method, max_count, values, key, limit, stop_fn, negative_offset
+        )
+
+        if prefetch:
+            pages = prefetch_iter(pages, prefetch)
+
+        for items in pages:
+            yield from items
+
+    def _get_all_pages(self, method, max_count, values, key, limit, stop_fn,
+                       negative_offset):
         values = values.copy() if values else {}
         values['count'] = max_count
 
@@ -77,7 +101,7 @@ class VkTools(object):
             items = response["items"]
             items_count += len(items)
 
-            yield from items
+            yield items
             if not response['more']:
                 break
 
@@ -109,8 +133,114 @@ class VkTools(object):
 
         return {'count': len(items), key: items}
 
+    def get_all_sharded_iter(self, method, max_count, values=None,
+                             key='items', workers=4, ordered=True,
+                             limit=None):
+        """ Получить все элементы, загружая части параллельно.
+
+        Первый запрос execute возвращает count, после этого оставшиеся
+        смещения делятся на окна по max_count * 25 элементов, которые
+        загружаются параллельно в `workers` потоках. Если вместо
+        :class:`VkApi` передан :class:`vk_api.token_pool.VkTokenPool`,
+        запросы распределяются между токенами.
+
+        В отличие от :meth:`get_all_iter` не учитывает изменение count
+        во время загрузки, поэтому подходит для списков, которые
+        не меняются (или меняются редко)
+
+        :param method: имя метода
+        :type method: str
+
+        :param max_count: максимальное количество элементов, которое можно
+                          получить за один запрос
+        :type max_count: int
+
+        :param values: параметры
+        :type values: dict
+
+        :param key: ключ элементов, которые нужно получить
+        :type key: str
+
+        :param workers: количество параллельных запросов
+        :type workers: int
+
+        :param ordered: False - возвращать элементы окон в порядке
+                        завершения запросов, а не по смещению
+        :type ordered: bool
+
+        :param limit: ограничение на количество получаемых элементов
+        :type limit: int
+        """
+
+        values = values.copy() if values else {}
+        values['count'] = max_count
+
+        window = max_count * 25
+
+        response = self._get_items_window(method, key, values, 0, window)
+
+        end = response['count']
+        if limit is not None:
+            end = min(end, limit)
+
+        yield from response[key]
+
+        offsets = iter(range(window, end, window))
+        pending = deque() if ordered else set()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            def submit_next():
+                offset = next(offsets, None)
+
+                if offset is None:
+                    return
+
+                future = executor.submit(
+                    self._get_items_window,
+                    method, key, values, offset, min(offset + window, end)
+                )
+
+                if ordered:
+                    pending.append(future)
+                else:
+                    pending.add(future)
+
+            # В очереди не больше 2 * workers окон, чтобы не держать
+            # в памяти все загруженные элементы, если обработка медленная
+            for _ in range(workers * 2):
+                submit_next()
+
+            try:
+                while pending:
+                    if ordered:
+                        done = [pending.popleft()]
+                    else:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        pending.difference_update(done)
+
+                    for future in done:
+                        items = future.result()[key]
+                        submit_next()
+
+                        yield from items
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _get_items_window(self, method, key, values, offset, end):
+        response = vk_get_items_window(self.vk, method, key, values, offset, end)
+
+        if 'execute_errors' in response:
+            raise VkToolsException(
+                f"Could not load items: {response['execute_errors']}",
+                response=response,
+            )
+
+        return response['response']
+
     def get_all_slow_iter(self, method, max_count, values=None, key='items',
-                          limit=None, stop_fn=None, negative_offset=False):
+                          limit=None, stop_fn=None, negative_offset=False,
+                          prefetch=0):
         """ Получить все элементы (без использования execute)
 
         Работает в методах, где в ответе есть count и items или users
@@ -137,8 +267,24 @@ class VkTools(object):
 
         :param negative_offset: True если offset должен быть отрицательный
         :type negative_offset: bool
+
+        :param prefetch: сколько следующих запросов выполнять заранее,
+                         см. :meth:`get_all_iter`
+        :type prefetch: int
         """
 
+        pages = self._get_all_slow_pages(
+            method, max_count, values, key, limit, stop_fn, negative_offset
+        )
+
+        if prefetch:
+            pages = prefetch_iter(pages, prefetch)
+
+        for items in pages:
+            yield from items
+
+    def _get_all_slow_pages(self, method, max_count, values, key, limit,
+                            stop_fn, negative_offset):
         values = values.copy() if values else {}
         values['count'] = max_count
 
@@ -166,7 +312,7 @@ class VkTools(object):
             items = response_items[count_diff:]
             items_count += len(items)
 
-            yield from items
+            yield items
             if len(response_items) < max_count - count_diff:
                 break
 
@@ -198,6 +344,60 @@ class VkTools(object):
         return {'count': len(items), key: items}
 
 
+_PREFETCH_END = object()
+
+
+def prefetch_iter(iterable, depth=1):
+    """ Перебирает `iterable` в фоновом потоке, заранее получая до `depth`
+        следующих элементов. Исключения передаются в вызывающий поток
+
+    :param iterable: итерируемый объект (например, генератор страниц)
+    :param depth: сколько элементов может ждать в буфере
+    :type depth: int
+    """
+
+    buffer = queue.Queue(maxsize=max(1, depth))
+    stopped = threading.Event()
+
+    def put(item):
+        # Если потребитель прекратил перебор, поток не должен
+        # навсегда заблокироваться на заполненном буфере
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((_PREFETCH_END, e))
+        else:
+            put((_PREFETCH_END, None))
+
+    thread = threading.Thread(target=produce, name='vk-prefetch', daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item, error = buffer.get()
+
+            if item is _PREFETCH_END:
+                if error is not None:
+                    raise error
+                return
+
+            yield item
+    finally:
+        stopped.set()
+
+
 vk_get_all_items = VkFunction(
     args=('method', 'key', 'values', 'count', 'offset', 'offset_mul'),
     clean_args=('method', 'key', 'offset', 'offset_mul'),
@@ -246,3 +446,51 @@ vk_get_all_items = VkFunction(
         more: calls != 99
     };
 ''')
+
+
+vk_get_items_window = VkFunction(
+    args=('method', 'key', 'values', 'offset', 'end'),
+    clean_args=('method', 'key', 'offset', 'end'),
+    return_raw=True,
+    code='''
+    var params = %(values)s,
+        max_count = params.count,
+        calls = 0,
+        items = [],
+        count = null,
+        offset = %(offset)s,
+        end = %(end)s,
+        ri;
+
+    while(calls < 25 && offset < end) {
+        calls = calls + 1;
+
+        params.offset = offset;
+        params.count = end - offset;
+        if (params.count > max_count) {
+            params.count = max_count;
+        }
+
+        var response = API.%(method)s(params);
+        if (!response) {
+            return {"_error": 1};
+        }
+
+        ri = response.%(key)s;
+        items = items + ri;
+        count = response.count;
+        offset = offset + params.count;
+
+        if (ri.length < params.count) {
+            offset = end;
+        }
+        if (count < end) {
+            end = count;
+        }
+    };
+
+    return {
+        count: count,
+        %(key)s: items
+    };
+''')
@@ -15,6 +15,21 @@ try:
 except ImportError:
     import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 from http.cookiejar import Cookie
 
 
@@ -57,13 +72,145 @@ def code_from_number(prefix, postfix, number):
     return number[prefix_len:-postfix_len]
 
 
+def _orjson_dumps(obj):
+    return orjson.dumps(obj).decode('utf-8')
+
+
+def _ujson_dumps(obj):
+    return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+#: Библиотеки JSON в порядке предпочтения
+JSON_BACKENDS = {
+    'orjson': orjson,
+    'ujson': ujson,
+    'json': json,
+}
+
+_JSON_DUMPS = {
+    'orjson': _orjson_dumps,
+    'ujson': _ujson_dumps,
+    'json': _json_dumps,
+}
+
+_json_backend = None
+_json_loads = None
+_json_dumps_fast = None
+
+
+def set_json_backend(name=None):
+    """ Выбор библиотеки для разбора и сериализации JSON
+
+    :param name: `orjson`, `ujson` или `json` (simplejson, если установлен,
+        иначе стандартный модуль). По умолчанию - первая установленная
+        в этом порядке
+    :type name: str
+    """
+
+    global _json_backend, _json_loads, _json_dumps_fast
+
+    if name is None:
+        name = next(
+            key for key, module in JSON_BACKENDS.items() if module is not None
+        )
+
+    module = JSON_BACKENDS[name]
+
+    if module is None:
+        raise ImportError(f'JSON backend {name} is not installed')
+
+    _json_backend = name
+    _json_loads = module.loads
+    _json_dumps_fast = _JSON_DUMPS[name]
+
+
+def get_json_backend():
+    """ Название используемой библиотеки JSON """
+    return _json_backend
+
+
+def json_loads(s):
+    """ Разбор JSON выбранной библиотекой
+
+    :param s: str или bytes (например, `response.content`)
+    """
+    return _json_loads(s)
+
+
 def sjson_dumps(*args, **kwargs):
+    if not kwargs and len(args) == 1:
+        try:
+            return _json_dumps_fast(args[0])
+        except (TypeError, ValueError, OverflowError):
+            # orjson не поддерживает ключи не-строки и int > 64 бит
+            pass
+
     kwargs['ensure_ascii'] = False
     kwargs['separators'] = (',', ':')
 
     return json.dumps(*args, **kwargs)
 
 
+set_json_backend()
+
+
+def iter_json_items(fp, path, document):
+    """ Потоковый разбор JSON: элементы массива `path` возвращаются
+        по одному по мере чтения `fp`, остальная часть документа (с пустым
+        массивом) записывается в `document` после перебора всех элементов.
+        Без ijson документ разбирается целиком
+
+    :param fp: файлоподобный объект с JSON
+    :param path: путь к массиву через точку (например, `response.items`)
+    :type path: str
+
+    :param document: словарь для остальной части документа
+    :type document: dict
+    """
+
+    if ijson is None:
+        root = json_loads(fp.read())
+
+        container = root
+        *parents, key = path.split('.')
+        for parent in parents:
+            container = container.get(parent) if isinstance(container, dict) else None
+
+        items = []
+        if isinstance(container, dict) and key in container:
+            items = container[key]
+            container[key] = []
+
+        document.update(root)
+        yield from items
+        return
+
+    items_prefix = f'{path}.item'
+    root = ijson.ObjectBuilder()
+    item = None
+
+    for prefix, event, value in ijson.parse(fp, use_float=True):
+        if prefix == items_prefix or prefix.startswith(f'{items_prefix}.'):
+            if item is None:
+                item = ijson.ObjectBuilder()
+
+            item.event(event, value)
+
+            # Элемент закончился: закрыт объект/массив или это скаляр
+            if (prefix == items_prefix
+                    and event not in ('start_map', 'start_array', 'map_key')):
+                yield item.value
+                item = None
+        else:
+            root.event(event, value)
+
+    document.update(root.value)
+
+
 HTTP_COOKIE_ARGS = [
     'version', 'name', 'value',
     'port', 'port_specified',
@@ -6,7 +6,6 @@
 :copyright: (c) 2019 python273
 """
 
-import json
 import logging
 import random
 import re
@@ -16,13 +15,16 @@ import urllib.parse
 from hashlib import md5
 
 import requests
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
 
 import jconfig
 from .enums import VkUserPermissions
 from .exceptions import *
+from .rate_limiter import VkRateLimiter
+from .retry import VkRetryPolicy
 from .utils import (
     code_from_number, search_re, clear_string,
-    cookies_to_list, set_cookies_from_list
+    cookies_to_list, set_cookies_from_list, json_loads, iter_json_items
 )
 
 RE_LOGIN_TO = re.compile(r'"to":"(.*?)"')
@@ -95,15 +97,41 @@ class VkApi(object):
 
     :param session: Кастомная сессия со своими параметрами(из библиотеки requests)
     :type session: :class:`requests.Session`
+
+    :param rate_limiter: Ограничитель частоты запросов к API. По умолчанию
+        используется адаптивный :class:`VkRateLimiter` с частотой не выше
+        `1 / RPS_DELAY`. Один ограничитель можно передать нескольким сессиям
+    :type rate_limiter: :class:`vk_api.rate_limiter.VkRateLimiter`
+
+    :param retry_policy: Политика повторов запросов к API при ошибках сети
+        и ответах 5xx. По умолчанию :class:`VkRetryPolicy` с параметрами
+        по умолчанию, `VkRetryPolicy(max_attempts=1)` отключает повторы
+    :type retry_policy: :class:`vk_api.retry.VkRetryPolicy`
+
+    :param timeout: Таймаут запросов к API в секундах: число или
+        кортеж (connect, read)
+    :type timeout: float or tuple
+
+    :param cache: Кэш ответов методов, которые только читают данные
+    :type cache: :class:`vk_api.cache.VkApiCache`
     """
 
     RPS_DELAY = 0.34  # ~3 requests per second
 
+    #: Ошибка "Слишком много запросов": максимальное количество повторов
+    #: одного запроса и параметры экспоненциальной задержки между ними
+    RPS_RETRY_LIMIT = 5
+    RPS_BACKOFF_BASE = 0.5
+    RPS_BACKOFF_MAX = 8.0
+
+    DEFAULT_TIMEOUT = (10, 60)
+
     def __init__(self, login=None, password=None, token=None,
                  auth_handler=None, captcha_handler=None,
                  config=jconfig.Config, config_filename='vk_config.v2.json',
                  api_version='5.92', app_id=6222115, scope=DEFAULT_USER_SCOPE,
-                 client_secret=None, session=None):
+                 client_secret=None, session=None, rate_limiter=None,
+                 retry_policy=None, timeout=DEFAULT_TIMEOUT, cache=None):
 
         self.login = login
         self.password = password
@@ -122,6 +150,23 @@ class VkApi(object):
             self.http.headers['User-agent'] = DEFAULT_USERAGENT
 
         self.last_request = 0.0
+        self.rate_limiter = rate_limiter or VkRateLimiter(
+            rps=1 / self.RPS_DELAY, adaptive=True
+        )
+        self.auto_batcher = None
+
+        self.retry_policy = retry_policy or VkRetryPolicy()
+        self.timeout = timeout
+        self.cache = cache
+
+        #: Счетчики ошибок частоты запросов и повторов
+        self.stats = {
+            'too_many_rps': 0,
+            'flood_control': 0,
+            'retries': 0,
+            'retry_budget_exhausted': 0,
+        }
+        self._rps_retries = threading.local()
 
         self.error_handlers = {
             NEED_VALIDATION_CODE: self.need_validation_handler,
@@ -370,11 +415,11 @@ class VkApi(object):
             'https://vk.com/al_login.php?act=a_authcheck_code',
             values
         )
-        data = json.loads(response.text.lstrip('<!--'))
+        data = json_loads(response.text.lstrip('<!--'))
         status = data['payload'][0]
 
         if status == '4':  # OK
-            path = json.loads(data['payload'][1][0])
+            path = json_loads(data['payload'][1][0])
             return self.http.get(path)
 
         elif status in [0, '8']:  # Incorrect code
@@ -484,7 +529,7 @@ class VkApi(object):
                 response = self.http.get(url)
             elif 'redirect_uri' in response.url:
                 response = self.http.get(response.url)
-                auth_json = json.loads(search_re(RE_AUTH_TOKEN_URL, response.text))
+                auth_json = json_loads(search_re(RE_AUTH_TOKEN_URL, response.text))
                 return_auth_hash = auth_json['data']['hash']['return_auth']
                 response = self.http.post(
                     'https://login.vk.com/?act=connect_internal',
@@ -497,7 +542,7 @@ class VkApi(object):
                     },
                     headers={'Origin': 'https://id.vk.com'}
                 )
-                connect_data = response.json()
+                connect_data = json_loads(response.content)
                 if connect_data['type'] != 'okay':
                     raise AuthError('Unknown API auth error')
                 auth_token = connect_data['data']['access_token']
@@ -516,7 +561,7 @@ class VkApi(object):
                     }
                 )
 
-                self.token = response.json()['response']
+                self.token = json_loads(response.content)['response']
 
                 self.storage.setdefault('token', {}).setdefault(
                     f'app{str(self.app_id)}', {}
@@ -558,7 +603,7 @@ class VkApi(object):
             self.logger.info('Got access_token')
 
         elif 'oauth.vk.com/error' in response.url:
-            error_data = response.json()
+            error_data = json_loads(response.content)
 
             error_text = error_data.get('error_description')
 
@@ -580,9 +625,9 @@ class VkApi(object):
             'grant_type': 'client_credentials'
         }
 
-        response = self.http.post(
+        response = json_loads(self.http.post(
             'https://oauth.vk.com/access_token', values
-        ).json()
+        ).content)
 
         if 'error' in response:
             raise AuthError(response['error_description'])
@@ -599,9 +644,9 @@ class VkApi(object):
             'code': code,
         }
 
-        response = self.http.post(
+        response = json_loads(self.http.post(
             'https://oauth.vk.com/access_token', values
-        ).json()
+        ).content)
 
         if 'error' in response:
             raise AuthError(response['error_description'])
@@ -638,24 +683,46 @@ class VkApi(object):
         pass  # TODO: write me
 
     def http_handler(self, error):
-        """ Обработчик ошибок соединения
+        """ Обработчик ошибок соединения. Вызывается, если ответ
+            с ошибкой получен после всех попыток `retry_policy`
 
         :param error: исключение
         """
 
         pass
 
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
     def too_many_rps_handler(self, error):
         """ Обработчик ошибки "Слишком много запросов в секунду".
-            Ждет полсекунды и пробует отправить запрос заново
+            Снижает частоту запросов, ждет (экспоненциальная задержка
+            со случайным разбросом) и пробует отправить запрос заново,
+            но не более `RPS_RETRY_LIMIT` раз
 
         :param error: исключение
         """
 
-        self.logger.warning('Too many requests! Sleeping 0.5 sec...')
+        attempt = getattr(self._rps_retries, 'attempt', 0)
+
+        if attempt >= self.RPS_RETRY_LIMIT:
+            self._count('retry_budget_exhausted')
+            raise error
+
+        delay = min(self.RPS_BACKOFF_MAX, self.RPS_BACKOFF_BASE * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)
+
+        self.logger.warning(f'Too many requests! Sleeping {delay:.2f} sec...')
 
-        time.sleep(0.5)
-        return error.try_method()
+        self._count('retries')
+        time.sleep(delay)
+
+        self._rps_retries.attempt = attempt + 1
+        try:
+            return error.try_method()
+        finally:
+            self._rps_retries.attempt = attempt
 
     def auth_handler(self):
         """ Обработчик двухфакторной аутентификации """
@@ -671,6 +738,30 @@ class VkApi(object):
 
         return VkApiMethod(self)
 
+    def enable_auto_batching(self, window=0.03, max_batch_size=25):
+        """ Включает автоматическое объединение запросов в execute
+
+            Вызовы :meth:`method` из разных потоков, сделанные в течение
+            `window` секунд, отправляются одним запросом execute.
+            Каждый вызов ждет до `window` секунд, поэтому режим полезен
+            при большом количестве параллельных запросов
+
+        :param window: время ожидания других запросов в секундах
+        :type window: float
+
+        :param max_batch_size: максимальное количество запросов в execute (max: 25)
+        :type max_batch_size: int
+        """
+
+        from .requests_pool import VkAutoBatcher
+
+        self.auto_batcher = VkAutoBatcher(self, window, max_batch_size)
+
+    def disable_auto_batching(self):
+        """ Выключает автоматическое объединение запросов в execute """
+
+        self.auto_batcher = None
+
     def method(self, method, values=None, captcha_sid=None, captcha_key=None,
                raw=False):
         """ Вызов метода API
@@ -694,6 +785,124 @@ class VkApi(object):
         :type raw: bool
         """
 
+        cache = self.cache
+        if cache is not None and not raw and not captcha_sid and cache.is_cacheable(method):
+            return cache.get_or_call(
+                method,
+                self._prepare_values(values),
+                lambda: self._method(method, values)
+            )
+
+        return self._method(method, values, captcha_sid, captcha_key, raw)
+
+    def _method(self, method, values=None, captcha_sid=None, captcha_key=None,
+                raw=False):
+        auto_batcher = self.auto_batcher
+        if auto_batcher and method != 'execute' and not raw and not captcha_sid:
+            return auto_batcher.method(method, values)
+
+        values = self._prepare_values(values, captcha_sid, captcha_key)
+        response = self._send(method, values)
+
+        if response.ok:
+            response = json_loads(response.content)
+        else:
+            error = ApiHttpError(self, method, values, raw, response)
+            response = self.http_handler(error)
+
+            if response is not None:
+                return response
+
+            raise error
+
+        if 'error' in response:
+            return self._handle_error(method, values, raw, response['error'])
+
+        self.rate_limiter.relax(values.get('access_token'))
+
+        return response if raw else response['response']
+
+    def method_stream(self, method, values=None, path='items', document=None):
+        """ Вызов метода API с потоковым разбором ответа
+
+            Элементы массива `path` возвращаются по одному по мере получения
+            ответа, весь ответ в памяти не хранится. Если модуль ijson
+            не установлен, ответ разбирается целиком.
+            Запрос отправляется сразу, а не при первом обращении к итератору
+
+        :param method: название метода
+        :type method: str
+
+        :param values: параметры
+        :type values: dict
+
+        :param path: путь к массиву в `response` через точку
+        :type path: str
+
+        :param document: словарь, в который после перебора всех элементов
+            записываются остальные поля `response` (например, count)
+        :type document: dict
+
+        :returns: итератор по элементам массива
+
+        >>> document = {}
+        >>> for item in vk_session.method_stream('wall.get', {'count': 100},
+        ...                                      document=document):
+        ...     print(item['id'])
+        >>> print(document['count'])
+        """
+
+        values = self._prepare_values(values)
+        response = self._send(method, values, stream=True)
+
+        return self._iter_stream(
+            response, method, values, path, {} if document is None else document
+        )
+
+    def _iter_stream(self, response, method, values, path, document):
+        with response:
+            if response.ok:
+                root = {}
+                response.raw.decode_content = True
+
+                # raw читается напрямую, поэтому ошибки urllib3 заменяются
+                # на исключения requests, как в Response.iter_content
+                try:
+                    yield from iter_json_items(
+                        response.raw, f'response.{path}', root
+                    )
+                except ProtocolError as e:
+                    raise requests.exceptions.ChunkedEncodingError(e)
+                except ReadTimeoutError as e:
+                    raise requests.exceptions.ConnectionError(e)
+
+                if 'error' not in root:
+                    self.rate_limiter.relax(values.get('access_token'))
+                    document.update(root.get('response', {}))
+                    return
+
+                # Ошибка приходит без элементов, поэтому ее можно обработать
+                # так же, как в method: результат обработчика - весь `response`
+                result = self._handle_error(method, values, False, root['error'])
+            else:
+                error = ApiHttpError(self, method, values, False, response)
+                result = self.http_handler(error)
+
+                if result is None:
+                    raise error
+
+        container = result
+        *parents, key = path.split('.')
+        for parent in parents:
+            container = container[parent]
+
+        items = container[key]
+        container[key] = []
+        document.update(result)
+
+        yield from items
+
+    def _prepare_values(self, values, captcha_sid=None, captcha_key=None):
         values = values.copy() if values else {}
 
         if 'v' not in values:
@@ -706,53 +915,62 @@ class VkApi(object):
             values['captcha_sid'] = captcha_sid
             values['captcha_key'] = captcha_key
 
-        with self.lock:
-            # Ограничение 3 запроса в секунду
-            delay = self.RPS_DELAY - (time.time() - self.last_request)
+        return values
+
+    def _send(self, method, values, stream=False):
+        url = f'https://api.vk.com/method/{method}'
 
-            if delay > 0:
-                time.sleep(delay)
+        def send():
+            # Слот резервируется заранее, поэтому запросы из разных потоков
+            # не ждут завершения друг друга
+            self.rate_limiter.wait(method, values.get('access_token'))
 
-            response = self.http.post(
-                f'https://api.vk.com/method/{method}',
+            return self.http.post(
+                url,
                 values,
                 headers={'Cookie': ''},
+                timeout=self.timeout,
+                stream=stream,
             )
-            self.last_request = time.time()
 
-        if response.ok:
-            response = response.json()
-        else:
-            error = ApiHttpError(self, method, values, raw, response)
-            response = self.http_handler(error)
+        response = self.retry_policy.call(
+            send, url, self.retry_policy.is_idempotent(method)
+        )
+        self.last_request = time.time()
 
-            if response is not None:
-                return response
+        return response
 
-            raise error
+    def _handle_error(self, method, values, raw, error_data):
+        """ Обработка ошибки API: вызывает обработчик из `error_handlers`
+            и возвращает его результат или выбрасывает исключение
+        """
 
-        if 'error' in response:
-            error = ApiError(self, method, values, raw, response['error'])
-
-            if error.code in self.error_handlers:
-                if error.code == CAPTCHA_ERROR_CODE:
-                    error = Captcha(
-                        self,
-                        error.error['captcha_sid'],
-                        self.method,
-                        (method,),
-                        {'values': values, 'raw': raw},
-                        error.error['captcha_img']
-                    )
+        error = ApiError(self, method, values, raw, error_data)
 
-                response = self.error_handlers[error.code](error)
+        if error.code in (TOO_MANY_RPS_CODE, FLOOD_CONTROL_CODE):
+            self._count(
+                'too_many_rps' if error.code == TOO_MANY_RPS_CODE
+                else 'flood_control'
+            )
+            self.rate_limiter.throttle(values.get('access_token'))
+
+        if error.code in self.error_handlers:
+            if error.code == CAPTCHA_ERROR_CODE:
+                error = Captcha(
+                    self,
+                    error.error['captcha_sid'],
+                    self.method,
+                    (method,),
+                    {'values': values, 'raw': raw},
+                    error.error['captcha_img']
+                )
 
-                if response is not None:
-                    return response
+            response = self.error_handlers[error.code](error)
 
-            raise error
+            if response is not None:
+                return response
 
-        return response if raw else response['response']
+        raise error
 
 class VkApiGroup(VkApi):
     """Предназначен для авторизации с токеном группы.
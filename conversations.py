@@ -0,0 +1,127 @@
+from common.vk_api.vk_api.execute import VkFunction
+from history import MAX_CALLS_PER_EXECUTE
+
+
+CONVERSATIONS_COUNT_PER_REQUEST = 200 # max 200
+USERS_COUNT_PER_REQUEST         = 1000
+
+
+class ProfileCache:
+    """
+    Names of users and groups, filled from the `profiles` and `groups`
+    returned by getConversations(extended=1)
+    """
+
+    def __init__(self):
+        self.profiles = {}
+        self.groups   = {}
+
+    def add(self, response):
+        for profile in response.get('profiles', []):
+            self.profiles[profile['id']] = profile
+        for group in response.get('groups', []):
+            self.groups[group['id']] = group
+
+    def load_missing(self, vk, user_ids):
+        """
+        Users that were not returned with the conversations (e.g. deleted
+        accounts) are requested with one users.get call per 1000 ids
+        """
+        missing_ids = [user_id for user_id in user_ids if user_id not in self.profiles]
+        for i in range(0, len(missing_ids), USERS_COUNT_PER_REQUEST):
+            chunk = missing_ids[i:i + USERS_COUNT_PER_REQUEST]
+            for profile in vk.users.get(user_ids=','.join(map(str, chunk))):
+                self.profiles[profile['id']] = profile
+
+    def get_profile(self, user_id):
+        return self.profiles.get(user_id)
+
+
+class Conversation:
+    """
+    What the exporter needs to know about a conversation from getConversations
+    """
+    __slots__ = ('peer_id', 'peer_type', 'title', 'folder_name', 'messages_count')
+
+    def __init__(self, conv_obj, profile_cache):
+        self.peer_id        = conv_obj['conversation']['peer']['id']
+        self.peer_type      = conv_obj['conversation']['peer']['type']
+        self.messages_count = None
+
+        if self.peer_type == 'user':
+            profile = profile_cache.get_profile(self.peer_id) or {}
+            first_name = profile.get('first_name', '')
+            last_name  = profile.get('last_name', '')
+            self.title       = f"user {self.peer_id} ({first_name} {last_name})"
+            self.folder_name = f"{self.peer_id}_{first_name}_{last_name}"
+        elif self.peer_type == 'chat':
+            chat_title = conv_obj['conversation']['chat_settings']['title']
+            self.title       = f"chat {self.peer_id} ({chat_title})"
+            self.folder_name = f"{self.peer_id}_{chat_title}"
+        elif self.peer_type == 'group':
+            self.title       = f"group {self.peer_id} (groups are not supported)"
+            self.folder_name = f"{self.peer_id}_group"
+        else:
+            self.title       = f"{self.peer_type} {self.peer_id} ({self.peer_type}s are not supported)"
+            self.folder_name = f"{self.peer_id}_{self.peer_type}"
+
+
+def iter_conversation_pages(vk, profile_cache):
+    """
+    Yields pages of Conversation objects. Names of the users are taken from
+    the `profiles` of the same response instead of a users.get call per peer.
+    """
+    offset = 0
+    total_count = None
+    while total_count is None or offset < total_count:
+        response = vk.messages.getConversations(
+            offset=offset,
+            count=CONVERSATIONS_COUNT_PER_REQUEST,
+            extended=1,
+            fields='first_name,last_name'
+        )
+        offset += CONVERSATIONS_COUNT_PER_REQUEST
+        total_count = response['count']
+
+        items = response.get('items')
+        if not items:
+            return
+
+        profile_cache.add(response)
+        profile_cache.load_missing(vk, [
+            conv_obj['conversation']['peer']['id'] for conv_obj in items
+            if conv_obj['conversation']['peer']['type'] == 'user'
+        ])
+
+        yield [Conversation(conv_obj, profile_cache) for conv_obj in items], total_count
+
+
+def load_messages_counts(vk, conversations):
+    """
+    Sets messages_count of the conversations, up to 25 of them are counted
+    with one execute request instead of a getHistory call per conversation
+    """
+    for i in range(0, len(conversations), MAX_CALLS_PER_EXECUTE):
+        chunk = conversations[i:i + MAX_CALLS_PER_EXECUTE]
+        counts = vk_get_messages_counts(vk, [conversation.peer_id for conversation in chunk])
+        for conversation, count in zip(chunk, counts):
+            conversation.messages_count = count
+
+
+vk_get_messages_counts = VkFunction(
+    args=('peer_ids',),
+    code='''
+    var peer_ids = %(peer_ids)s,
+        counts = [],
+        i = 0;
+
+    while (i < peer_ids.length) {
+        counts.push(API.messages.getHistory({
+            "peer_id": peer_ids[i],
+            "count": 1
+        }).count);
+        i = i + 1;
+    };
+
+    return counts;
+''')
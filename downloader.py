@@ -0,0 +1,214 @@
+import os
+import queue
+import requests
+import shutil
+import threading
+
+from concurrent.futures import Future
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# VK serves attachments from dozens of CDN hosts (sun9-XX.userapi.com, ...),
+# keep a connection pool for each of them
+DOWNLOAD_HOST_POOLS = 128
+
+
+class DownloadPool:
+    """
+    Bounded pool of worker threads for attachment downloads.
+
+    Jobs are queued by the history walker and fetched in parallel, `submit`
+    blocks when `max_pending` jobs are already waiting, so the pager never
+    runs too far ahead of the downloads. Jobs queued by the workers themselves
+    (parts of a video, see video_download.py) don't wait for a free slot, a worker
+    blocked on the full queue could never free it. Waiting jobs are started in the
+    order of their priority, see `submit`.
+    """
+
+    def __init__(self, workers=4, max_pending=None, session=None, retry_policy=None):
+        self.workers      = max(1, int(workers))
+        self.max_pending  = max_pending or self.workers * 4
+        self.session      = session or create_download_session(self.workers)
+        self.retry_policy = retry_policy
+
+        self.jobs  = queue.PriorityQueue()
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.lock  = threading.Lock()
+        self.idle  = threading.Condition(self.lock)
+
+        self.submitted_count  = 0
+        self.unfinished_count = 0
+        self.completed_count  = 0
+        self.failed_count     = 0
+
+        self.threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"download-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, fn, *args, priority = 0, size_hint = None, **kwargs):
+        """
+        Jobs with lower `priority` are started first. The priority is counted in jobs:
+        a job is overtaken by at most `priority` jobs submitted after it, so low priority
+        jobs are delayed but never starved. Jobs of the same order start from the smaller
+        `size_hint` (expected size in bytes, if known)
+        """
+        future  = Future()
+        bounded = threading.current_thread() not in self.threads
+        if bounded:
+            self.slots.acquire()
+        with self.lock:
+            self.submitted_count  += 1
+            self.unfinished_count += 1
+            order = (self.submitted_count + priority, size_hint or 0, self.submitted_count)
+        self.jobs.put((order, (future, fn, args, kwargs, bounded)))
+        return future
+
+    def join(self):
+        """
+        Waits until all submitted jobs are finished
+        """
+        with self.idle:
+            while self.unfinished_count > 0:
+                self.idle.wait()
+
+    def close(self):
+        self.join()
+        # stop markers go after all the jobs
+        for i, _ in enumerate(self.threads):
+            self.jobs.put(((float('inf'), 0, i), None))
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _worker(self):
+        while True:
+            _, job = self.jobs.get()
+            if job is None:
+                return
+            future, fn, args, kwargs, bounded = job
+            if bounded:
+                self.slots.release()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    print(f"download failed: {e}")
+                    future.set_exception(e)
+            with self.idle:
+                self.unfinished_count -= 1
+                if future.cancelled() or future.exception() is not None:
+                    self.failed_count += 1
+                else:
+                    self.completed_count += 1
+                if self.unfinished_count == 0:
+                    self.idle.notify_all()
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# (connect, read) timeouts, the read timeout limits a stall between two chunks
+DEFAULT_DOWNLOAD_TIMEOUT = (10, 60)
+
+
+def create_download_session(pool_size, max_retries=3, backoff_factor=0.5):
+    """
+    Session shared by all download workers. Connections to the CDN hosts are
+    kept alive and reused, `pool_size` should match the number of workers
+    """
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=DOWNLOAD_HOST_POOLS,
+        pool_maxsize=pool_size,
+        max_retries=retry
+    )
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_connection_stats(session):
+    """
+    Returns (requests, connections) made through the session's connection pools
+    """
+    requests_count    = 0
+    connections_count = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_count    += pool.num_requests
+            connections_count += pool.num_connections
+    return requests_count, connections_count
+
+
+def format_download_stats(download_pool):
+    requests_count, connections_count = get_connection_stats(download_pool.session)
+    reuse_ratio = 0.0
+    if requests_count > 0:
+        reuse_ratio = 1.0 - connections_count / requests_count
+    return (
+        f"downloads completed: {download_pool.completed_count}, failed: {download_pool.failed_count}, "
+        f"http requests: {requests_count}, connections opened: {connections_count}, "
+        f"connection reuse: {reuse_ratio:.0%}"
+    )
+
+
+def download_file(session, url, filepath, chunk_size=DEFAULT_CHUNK_SIZE, retry_policy=None,
+                  timeout=DEFAULT_DOWNLOAD_TIMEOUT):
+    """
+    Streams the response body to a temporary file and renames it when the
+    download is complete, so only one chunk per worker is held in memory and
+    an interrupted download never leaves a truncated file under the final name.
+    With `retry_policy` (VkRetryPolicy) the whole transfer is retried, including
+    a connection dropped in the middle of the body
+    """
+    tmp_filepath = filepath + '.part'
+
+    def fetch():
+        with session.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            with open(tmp_filepath, 'wb') as handler:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    handler.write(chunk)
+        return response
+
+    try:
+        if retry_policy is None:
+            fetch()
+        else:
+            retry_policy.call(fetch, url)
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        if os.path.isfile(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
+
+
+def copy_file(source_filepath, filepath):
+    tmp_filepath = filepath + '.part'
+    try:
+        shutil.copyfile(source_filepath, tmp_filepath)
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        if os.path.isfile(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
@@ -0,0 +1,182 @@
+import os
+import sqlite3
+import threading
+
+from concurrent.futures import wait
+
+
+STATE_FILE_NAME            = ".export_state.sqlite"
+ATTACHMENT_INDEX_FILE_NAME = ".attachment_index.sqlite"
+
+
+def open_database(filepath):
+    # download workers report finished attachments from their own threads
+    db = sqlite3.connect(filepath, check_same_thread=False)
+    with db:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS attachments (key TEXT PRIMARY KEY, path TEXT)")
+    return db
+
+
+class ExportState:
+    """
+    Persistent export progress of one conversation, stored in the chat folder.
+
+    Keeps the history cursor (the oldest message id whose attachments are all
+    downloaded), the newest exported message id and the list of attachments
+    that are already on disk, so an interrupted export can be resumed.
+    """
+
+    def __init__(self, chat_folder_full_path):
+        self.filepath = os.path.join(chat_folder_full_path, STATE_FILE_NAME)
+        self.lock = threading.Lock()
+        self.db = open_database(self.filepath)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.downloaded = {key for key, in self.db.execute("SELECT key FROM attachments")}
+
+    def get_meta(self, key, default = None):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def get_resume_message_id(self):
+        """
+        Returns message id to continue the history walk from, -1 means from the newest message
+        """
+        if self.is_history_complete():
+            return -1
+        return int(self.get_meta('oldest_message_id', -1))
+
+    def set_resume_message_id(self, message_id):
+        self.set_meta('oldest_message_id', message_id)
+
+    def get_newest_message_id(self):
+        value = self.get_meta('newest_message_id')
+        return None if value is None else int(value)
+
+    def set_newest_message_id(self, message_id):
+        self.set_meta('newest_message_id', message_id)
+
+    def is_history_complete(self):
+        return self.get_meta('history_complete') == '1'
+
+    def set_history_complete(self, complete):
+        self.set_meta('history_complete', 1 if complete else 0)
+
+    def is_downloaded(self, key):
+        return key in self.downloaded
+
+    def add_downloaded(self, key, filepath):
+        with self.lock, self.db:
+            self.downloaded.add(key)
+            self.db.execute("INSERT OR REPLACE INTO attachments (key, path) VALUES (?, ?)", (key, filepath))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class AttachmentIndex:
+    """
+    Attachments saved in any conversation, maps attachment key to the file path.
+    Lets a photo forwarded into several chats be fetched only once.
+    Kept in memory, and optionally persisted when `filepath` is given.
+    Downloads in progress are tracked too, so conversations exported in parallel
+    don't fetch the same attachment at the same time.
+    """
+
+    def __init__(self, filepath = None):
+        self.lock    = threading.Lock()
+        self.db      = None
+        self.paths   = {}
+        # attachments that are being downloaded, key -> future
+        self.pending = {}
+        if filepath is not None:
+            self.db = open_database(filepath)
+            self.paths = dict(self.db.execute("SELECT key, path FROM attachments"))
+
+    def get_path(self, key):
+        return self.paths.get(key)
+
+    def start_download(self, key, future):
+        """
+        Registers the download of `key` resolved with `future`. Returns the future
+        of the same download already started by another conversation, None if there is none
+        """
+        with self.lock:
+            pending = self.pending.get(key)
+            if pending is not None:
+                return pending
+            self.pending[key] = future
+            return None
+
+    def finish_download(self, key, future):
+        """
+        Called when the download is finished, after `add` on success
+        """
+        with self.lock:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+
+    def add(self, key, filepath):
+        with self.lock:
+            if key in self.paths:
+                return
+            self.paths[key] = filepath
+            if self.db is not None:
+                with self.db:
+                    self.db.execute("INSERT OR REPLACE INTO attachments (key, path) VALUES (?, ?)", (key, filepath))
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+
+
+def is_failed(future):
+    return future.cancelled() or future.exception() is not None
+
+
+class HistoryCursor:
+    """
+    Moves the persisted position only past pages whose downloads are all finished successfully.
+    Downloads run in the background, so the pager is usually a few pages ahead.
+    After a failed download the position stays before its page, so the page is walked
+    again and the download is retried on the next run.
+    `save_message_id` is the state setter for the position, e.g. ExportState.set_resume_message_id
+    """
+
+    def __init__(self, save_message_id):
+        self.save_message_id = save_message_id
+        self.pages = []
+        self.failed = False
+
+    def add_page(self, last_message_id, futures):
+        self.pages.append((last_message_id, futures))
+        self.commit_finished()
+
+    def commit_finished(self):
+        finished_message_id = None
+        while not self.failed and self.pages and all(future.done() for future in self.pages[0][1]):
+            if any(is_failed(future) for future in self.pages[0][1]):
+                self.failed = True
+                break
+            finished_message_id, _ = self.pages.pop(0)
+        if finished_message_id is not None:
+            self.save_message_id(finished_message_id)
+
+    def wait_finished(self):
+        """
+        Waits for all downloads of the added pages and saves the last position.
+        Returns False if some of the downloads failed
+        """
+        for _, futures in self.pages:
+            wait(futures)
+        self.commit_finished()
+        return not self.failed
@@ -0,0 +1,122 @@
+import requests
+import time
+
+from common.vk_api.vk_api.execute import VkFunction
+
+
+MESSAGES_COUNT_PER_REQUEST = 200 # max 200
+MAX_CALLS_PER_EXECUTE      = 25  # VK limit of API calls inside one execute
+
+# A streamed response dropped in the middle is requested again from the last yielded message
+STREAM_READ_ERRORS   = (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError)
+STREAM_READ_RETRIES  = 3
+STREAM_RETRY_BACKOFF = 2 # seconds, doubled after every retry
+
+
+def iter_history_pages(vk, peer_id, start_message_id = -1, calls_per_execute = MAX_CALLS_PER_EXECUTE,
+                       parse = None, stream = False):
+    """
+    Walks the history from `start_message_id` (-1 - the newest message) to the oldest one.
+    Up to `calls_per_execute` getHistory calls are chained inside one execute request,
+    so each page holds up to 25 * 200 messages for one API round trip.
+    Yields (items, total_count, last_message_id), the message `start_message_id` itself is skipped.
+    With `parse` the items are converted by it and the raw response is released before yielding.
+
+    With `stream` the execute response is parsed while it is being received and
+    the messages are yielded in chunks of MESSAGES_COUNT_PER_REQUEST, so the
+    downloads start before the whole page is read. total_count is None until
+    the end of the first page, it comes after the messages in the response.
+    If the connection drops while the response is being read, the execute is sent
+    again starting from the last yielded message, up to STREAM_READ_RETRIES times in a row.
+    """
+    calls_per_execute = max(1, min(int(calls_per_execute), MAX_CALLS_PER_EXECUTE))
+    total_count = None
+    read_retries = 0
+    more = True
+    while more:
+        args = (vk, peer_id, start_message_id, MESSAGES_COUNT_PER_REQUEST, calls_per_execute)
+        if stream:
+            response       = {}
+            response_items = vk_get_history.stream(*args, document=response)
+        else:
+            response       = vk_get_history(*args)
+            response_items = response['items']
+
+        # every chained call starts from the last message of the previous one,
+        # ids are decreasing, so boundary messages are the only repeated ones
+        items = []
+        last_message_id = start_message_id
+        yielded_message_id = start_message_id
+        try:
+            for item in response_items:
+                if last_message_id != -1 and item['id'] >= last_message_id:
+                    continue
+                items.append(item if parse is None else parse(item))
+                last_message_id = item['id']
+
+                if stream and len(items) >= MESSAGES_COUNT_PER_REQUEST:
+                    yield items, total_count, last_message_id
+                    items = []
+                    yielded_message_id = last_message_id
+                    read_retries = 0
+        except STREAM_READ_ERRORS as e:
+            if not stream or read_retries >= STREAM_READ_RETRIES:
+                raise
+            print(f"peer_id {peer_id}: history response dropped ({e}), requesting it again")
+            time.sleep(STREAM_RETRY_BACKOFF * 2 ** read_retries)
+            read_retries += 1
+            # the messages after the last yielded chunk are requested again
+            start_message_id = yielded_message_id
+            response         = None
+            response_items   = None
+            continue
+
+        more             = response['more'] and last_message_id != start_message_id
+        total_count      = response['count']
+        start_message_id = last_message_id
+        read_retries     = 0
+        response         = None
+        response_items   = None
+        item             = None
+
+        if len(items) > 0:
+            yield items, total_count, last_message_id
+
+
+vk_get_history = VkFunction(
+    args=('peer_id', 'start_message_id', 'count', 'max_calls'),
+    clean_args=('count', 'max_calls'),
+    code='''
+    var peer_id = %(peer_id)s,
+        start_message_id = %(start_message_id)s,
+        calls = 0,
+        items = [],
+        count = 0,
+        more = true;
+
+    while (calls < %(max_calls)s && more) {
+        calls = calls + 1;
+
+        var response = API.messages.getHistory({
+            "peer_id": peer_id,
+            "offset": 0,
+            "count": %(count)s,
+            "start_message_id": start_message_id
+        });
+
+        count = response.count;
+        items = items + response.items;
+
+        if (response.items.length < %(count)s) {
+            more = false;
+        } else {
+            start_message_id = response.items[response.items.length - 1].id;
+        }
+    };
+
+    return {
+        count: count,
+        items: items,
+        more: more
+    };
+''')
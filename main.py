@@ -1,21 +1,39 @@
 import json
 import os
-import requests
-import shutil
+import threading
 import yaml
 
 from common.vk_api.vk_api import *
 from common.vk_api.vk_api.audio import VkAudio
-
+from common.vk_api.vk_api.tools import prefetch_iter
+from attachment_handlers import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, DownloadJob, attachment_handler, get_attachment_handler
+from blob_store import BLOB_STORE_FOLDER_NAME, BlobStore
+from conversations import ProfileCache, iter_conversation_pages, load_messages_counts
+from downloader import (
+    DEFAULT_CHUNK_SIZE, DownloadPool, copy_file, create_download_session, download_file, format_download_stats
+)
+from export_state import ATTACHMENT_INDEX_FILE_NAME, AttachmentIndex, ExportState, HistoryCursor
+from history import MAX_CALLS_PER_EXECUTE, MESSAGES_COUNT_PER_REQUEST, iter_history_pages
+from messages import DEFAULT_ATTACHMENT_TYPES, parse_message
+from photo_sizes import SizePolicy
+from scheduler import FairGate, FairVkApi
+from video_download import (
+    DEFAULT_SEGMENT_SIZE, VideoFetch, VideoUnavailable, resolve_video_files, select_video_file
+)
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from datetime import datetime
 
 
-config        = None
-configPrivate = None
+config           = None
+configPrivate    = None
+size_policy      = None
+attachment_types = None
 
 
 CONFIG_FILE_NAME         = "config.yaml"
 CONFIG_PRIVATE_FILE_NAME = "config.private.yaml"
+API_CACHE_FILE_NAME      = ".api_cache.json"
 
 
 def load_config():
@@ -36,6 +54,24 @@ def get_cvar(name, default = None):
     if config.get(name) is not None:
         return config.get(name)
     return default
+
+
+def get_size_policy():
+    global size_policy
+    if size_policy is None:
+        size_policy = SizePolicy(get_cvar('photo_size', 'largest'))
+    return size_policy
+
+
+def get_attachment_types():
+    global attachment_types
+    if attachment_types is None:
+        attachment_types = set(get_cvar('attachment_types', DEFAULT_ATTACHMENT_TYPES))
+        if get_cvar('process_video', False):
+            attachment_types.add('video')
+        else:
+            attachment_types.discard('video')
+    return attachment_types
     
 
 def is_image_extension(extension: str) -> bool:
@@ -87,77 +123,261 @@ def captcha_handler(captcha):
     return captcha.try_again(key)
 
 
-def find_best_resolution(images):
-    best_img = None
-    best_img_size = -1
-    for img in images:
-        current_img_size = img['height'] * img['width']
-        if current_img_size > best_img_size:
-            best_img_size = current_img_size
-            best_img = img
-    return best_img
-
+class ChatContext:
+    """
+    Per-conversation download state shared by the process_* functions
+    """
 
-def process_photo(photo, chat_folder_full_path, urls_downloaded):
-    strname = datetime.fromtimestamp(int(photo['date'])).strftime('IMG_%Y_%m_%d__%H_%M_%S')
-    best_img = find_best_resolution(photo['sizes'])
-    
-    filepath = os.path.join(chat_folder_full_path, strname)
-    if os.path.isfile(filepath + '.jpg'):
-        if best_img['url'] in urls_downloaded:
-            return
+    def __init__(self, folder_full_path, download_pool, state, attachment_index, blob_store = None):
+        self.folder_full_path = folder_full_path
+        self.download_pool    = download_pool
+        self.state            = state
+        self.attachment_index = attachment_index
+        self.blob_store       = blob_store
+        # attachments queued in this conversation during the current run
+        self.queued_keys      = set()
+        # files that are queued for download but may not exist on disk yet
+        self.reserved_paths   = set()
+        # downloads queued while processing the current history page
+        self.page_futures     = []
+
+    def is_path_taken(self, filepath):
+        return filepath in self.reserved_paths or os.path.isfile(filepath)
+
+    def is_downloaded(self, key):
+        return key in self.queued_keys or self.state.is_downloaded(key)
+
+    def mark_downloaded(self, key, filepath):
+        self.queued_keys.add(key)
+        self.state.add_downloaded(key, filepath)
+        self.attachment_index.add(key, filepath)
+
+    def get_free_filepath(self, filepath, ext):
+        """
+        Returns `filepath.ext`, or `filepath_N.ext` if the name is already taken
+        """
+        if not self.is_path_taken(f"{filepath}.{ext}"):
+            return f"{filepath}.{ext}"
         i = 1
-        while(os.path.isfile(f"{filepath}_{str(i)}.jpg")):
+        while(self.is_path_taken(f"{filepath}_{str(i)}.{ext}")):
             i += 1
-        filepath = f"{filepath}_{str(i)}"
+        return f"{filepath}_{str(i)}.{ext}"
+
+    def download(self, job):
+        self.page_futures.append(self.queue_download(job))
+
+    def queue_download(self, job):
+        """
+        Queues the download job, attachments that are already saved in another
+        conversation are copied from there instead of being fetched again,
+        the ones that another conversation is downloading right now are copied
+        once it is finished. With the blob store enabled the file is linked to the stored blob.
+        Returns a future that is resolved once the download (or its fallback) is recorded
+        """
+        key, filepath = job.key, job.filepath
+        self.queued_keys.add(key)
+        self.reserved_paths.add(filepath)
+
+        # the cursor waits for `done`, it is resolved only after the download is recorded,
+        # so the state is never closed before the callback writes to it
+        done = Future()
+        done.set_running_or_notify_cancel()
+
+        if job.url is None:
+            # nothing to download, the file is already saved
+            self.mark_downloaded(key, filepath)
+            done.set_result(None)
+            return done
+
+        if self.blob_store is not None:
+            # the blob store shares the downloads between conversations itself
+            future = self.blob_store.store(key, filepath, self.get_submit(job))
+        else:
+            in_progress = self.attachment_index.start_download(key, done)
+            if in_progress is None:
+                future = self.get_submit(job)(filepath)
+            else:
+                future = self.copy_when_finished(key, in_progress, filepath)
+
+        def on_downloaded(f):
+            try:
+                error = f.exception()
+                if error is None:
+                    self.mark_downloaded(key, filepath)
+            except Exception as e:
+                error = e
+            # after a failure other conversations download the attachment themselves
+            self.attachment_index.finish_download(key, done)
+            if error is not None:
+                done.set_exception(error)
+            else:
+                done.set_result(None)
 
-    raw_data = requests.get(best_img['url']).content
-    with open(filepath + '.jpg', 'wb') as handler:
-        handler.write(raw_data)
-    urls_downloaded.append(best_img['url'])
+        future.add_done_callback(on_downloaded)
+        if job.fallback is None:
+            return done
 
+        # the conversations waiting for `done` queue their own fallbacks
+        recorded = Future()
+        recorded.set_running_or_notify_cancel()
 
-def process_doc(doc, chat_folder_full_path, urls_downloaded):
-    if doc['type'] in get_cvar('doc_ignore_by_type', []):
-        return
+        def on_fallback_recorded(f):
+            if f.exception() is not None:
+                recorded.set_exception(f.exception())
+            else:
+                recorded.set_result(None)
+
+        def on_done(f):
+            if isinstance(f.exception(), VideoUnavailable):
+                print(f"{key}: {f.exception()}, saving the preview instead")
+                self.queue_download(job.fallback).add_done_callback(on_fallback_recorded)
+            else:
+                on_fallback_recorded(f)
+
+        done.add_done_callback(on_done)
+        return recorded
+
+    def get_submit(self, job):
+        """
+        Returns submit(target_filepath) -> Future that queues the download of the job to the pool
+        """
+        url = job.url
+        source_filepath = self.attachment_index.get_path(job.key)
+        # a preview saved in place of the file is not copied under the file name
+        if (source_filepath is not None and os.path.isfile(source_filepath)
+                and os.path.splitext(source_filepath)[1] == os.path.splitext(job.filepath)[1]):
+            fetch = lambda target_filepath: copy_file(source_filepath, target_filepath)
+        elif job.fetcher is None:
+            chunk_size   = get_cvar('download_chunk_size', DEFAULT_CHUNK_SIZE)
+            timeout      = (10, get_cvar('request_timeout', 60))
+            session      = self.download_pool.session
+            retry_policy = self.download_pool.retry_policy
+            fetch = lambda target_filepath: download_file(
+                session, url, target_filepath, chunk_size, retry_policy, timeout
+            )
+        else:
+            fetch = None
+
+        if fetch is None:
+            # the download is split into several pool jobs by the fetcher
+            return lambda target_filepath: job.fetcher.submit(self.download_pool, target_filepath, job.priority)
+        return lambda target_filepath: self.download_pool.submit(
+            fetch, target_filepath, priority=job.priority, size_hint=job.size_hint
+        )
+
+    def copy_when_finished(self, key, in_progress, filepath):
+        """
+        Copies the attachment once the conversation that is downloading it has saved it.
+        The copy is made by the thread that finishes that download, no worker waits for it
+        """
+        result = Future()
+        result.set_running_or_notify_cancel()
+
+        def on_finished(f):
+            try:
+                error = f.exception()
+                if error is None:
+                    copy_file(self.attachment_index.get_path(key), filepath)
+            except Exception as e:
+                error = e
+            if error is not None:
+                result.set_exception(error)
+            else:
+                result.set_result(None)
+
+        in_progress.add_done_callback(on_finished)
+        return result
+
+    def pop_page_futures(self):
+        futures = self.page_futures
+        self.page_futures = []
+        return futures
+
+
+@attachment_handler('photo')
+def process_photo(photo, ctx):
+    if photo.url is None or ctx.is_downloaded(photo.key):
+        return []
+
+    strname = datetime.fromtimestamp(int(photo.date)).strftime('IMG_%Y_%m_%d__%H_%M_%S')
+    
+    filepath = ctx.get_free_filepath(os.path.join(ctx.folder_full_path, strname), 'jpg')
+
+    return [DownloadJob(photo.key, photo.url, filepath, PRIORITY_HIGH)]
+
+
+@attachment_handler('doc')
+def process_doc(doc, ctx):
+    if doc.type in get_cvar('doc_ignore_by_type', []):
+        return []
     
     prefix = 'DOC'
-    if is_image_extension(doc['ext']):
+    if is_image_extension(doc.ext):
         prefix = 'IMG'
-    elif is_video_extension(doc['ext']):
+    elif is_video_extension(doc.ext):
         prefix = 'VID'
     else:
-        return
+        return []
+
+    if (doc.url is None and doc.preview_url is None) or ctx.is_downloaded(doc.key):
+        return []
     
-    strtime = datetime.fromtimestamp(int(doc['date'])).strftime("%Y_%m_%d__%H_%M_%S")
-    strname = f"{prefix}_{strtime}_{filename_rm_invalid_symbols(doc['title'])}"
+    strtime = datetime.fromtimestamp(int(doc.date)).strftime("%Y_%m_%d__%H_%M_%S")
+    strname = f"{prefix}_{strtime}_{filename_rm_invalid_symbols(doc.title)}"
+
+    if doc.url is None:
+        # documents that can't be downloaded anymore still may have a preview, it is always a jpg
+        filepath = ctx.get_free_filepath(os.path.join(ctx.folder_full_path, f"{strname}_preview"), 'jpg')
+        return [DownloadJob(doc.key, doc.preview_url, filepath, PRIORITY_NORMAL)]
     
-    filepath = os.path.join(chat_folder_full_path, strname)
-    if os.path.isfile(filepath):
-        if doc['url'] in urls_downloaded:
-            return
+    filepath = os.path.join(ctx.folder_full_path, strname)
+    if ctx.is_path_taken(filepath):
         i = 1
-        while(os.path.isfile(f"{filepath}_{str(i)}.{doc['ext']}")):
+        while(ctx.is_path_taken(f"{filepath}_{str(i)}.{doc.ext}")):
             i += 1
-        filepath = f"{filepath}_{str(i)}.{doc['ext']}"
+        filepath = f"{filepath}_{str(i)}.{doc.ext}"
+
+    return [DownloadJob(doc.key, doc.url, filepath, PRIORITY_NORMAL, doc.size)]
+
 
-    raw_data = requests.get(doc['url']).content
-    with open(filepath, 'wb') as handler:
-        handler.write(raw_data)
-    urls_downloaded.append(doc['url'])
+def create_video_fetcher(video, ctx):
+    """
+    Returns (url, fetcher, extension) of the video file, None if it can't be downloaded.
+    Large mp4 files are split into ranges, HLS streams into their segments,
+    both are downloaded by the pool workers in parallel. The file is resolved
+    by a pool job too, see VideoFetch
+    """
+    max_height = get_cvar('video_max_quality', 1080)
+    selected   = select_video_file(video.files or {}, max_height)
+    if selected is None:
+        return None
+
+    kind, url = selected
+    fetcher   = VideoFetch(
+        ctx.download_pool.session, kind, url, max_height,
+        get_cvar('video_segment_size', DEFAULT_SEGMENT_SIZE),
+        get_cvar('download_chunk_size', DEFAULT_CHUNK_SIZE),
+        ctx.download_pool.retry_policy,
+        (10, get_cvar('request_timeout', 60))
+    )
+    return url, fetcher, 'ts' if kind == 'hls' else 'mp4'
 
 
-def process_video(video, chat_folder_full_path, urls_downloaded, msg):
+@attachment_handler('video')
+def process_video(video, ctx):
     """
-    Fast hack - downloading only the preview and dumping message and video data. 
-    Need to find necessary videos manually. 
-    Removing duplicates is not supported yet.
+    Dumps the message and video data and downloads the video file.
+    When the file is not available (external videos, no access, encrypted streams)
+    only the preview is downloaded.
     """
-    video_folder = os.path.join(chat_folder_full_path, "video_info")
+    if ctx.is_downloaded(video.key):
+        return []
+
+    video_folder = os.path.join(ctx.folder_full_path, "video_info")
     os.makedirs(video_folder, exist_ok=True)
 
-    strtime = datetime.fromtimestamp(int(msg['date'])).strftime("%Y_%m_%d__%H_%M_%S")
-    strname = f"VID_{strtime}_{filename_rm_invalid_symbols(video.get('title', ''))}"
+    strtime = datetime.fromtimestamp(int(video.date)).strftime("%Y_%m_%d__%H_%M_%S")
+    strname = f"VID_{strtime}_{filename_rm_invalid_symbols(video.title)}"
 
     filepath = os.path.join(video_folder, strname)
     if os.path.isfile(filepath + '.json'):
@@ -167,123 +387,287 @@ def process_video(video, chat_folder_full_path, urls_downloaded, msg):
         filepath = f"{filepath}_{str(i)}"
     
     with open(f"{filepath}.json", "w") as f:
-        f.write(f"vid: {json.dumps(video)}")
+        f.write(f"vid: {json.dumps(video.raw)}")
 
     with open(f"{filepath}_msg.json", "w") as f:
-        f.write(f"vid: {json.dumps(msg)}")
+        f.write(f"vid: {json.dumps(video.message)}")
+
+    if video.first_frame_url is not None:
+        preview = DownloadJob(video.key, video.first_frame_url, f"{filepath}.jpg", PRIORITY_LOW)
+    else:
+        # only the video info is kept
+        preview = DownloadJob(video.key, None, f"{filepath}.json", PRIORITY_LOW)
+
+    video_file = create_video_fetcher(video, ctx)
+    if video_file is not None:
+        url, fetcher, extension = video_file
+        video_filepath = ctx.get_free_filepath(os.path.join(ctx.folder_full_path, strname), extension)
+        return [DownloadJob(video.key, url, video_filepath, PRIORITY_LOW, fetcher=fetcher, fallback=preview)]
+
+    if preview.url is not None:
+        return [preview]
+
+    ctx.mark_downloaded(video.key, preview.filepath)
+    return []
+
+
+@attachment_handler('audio_message')
+def process_audio_message(audio_message, ctx):
+    if audio_message.url is None or ctx.is_downloaded(audio_message.key):
+        return []
+
+    strname  = datetime.fromtimestamp(int(audio_message.date)).strftime('AUDIO_%Y_%m_%d__%H_%M_%S')
+    filepath = ctx.get_free_filepath(os.path.join(ctx.folder_full_path, strname), audio_message.ext)
+
+    return [DownloadJob(audio_message.key, audio_message.url, filepath, PRIORITY_HIGH)]
+
+
+@attachment_handler('graffiti')
+def process_graffiti(graffiti, ctx):
+    if graffiti.url is None or ctx.is_downloaded(graffiti.key):
+        return []
+
+    strname  = datetime.fromtimestamp(int(graffiti.date)).strftime('GRAFFITI_%Y_%m_%d__%H_%M_%S')
+    filepath = ctx.get_free_filepath(os.path.join(ctx.folder_full_path, strname), 'png')
+
+    return [DownloadJob(graffiti.key, graffiti.url, filepath, PRIORITY_HIGH)]
+
+
+@attachment_handler('sticker')
+def process_sticker(sticker, ctx):
+    if sticker.url is None or ctx.is_downloaded(sticker.key):
+        return []
+
+    sticker_folder = os.path.join(ctx.folder_full_path, "stickers")
+    os.makedirs(sticker_folder, exist_ok=True)
+
+    filepath = os.path.join(sticker_folder, f"STICKER_{sticker.sticker_id}.png")
+
+    return [DownloadJob(sticker.key, sticker.url, filepath, PRIORITY_LOW)]
+
+
+@attachment_handler('link')
+def process_link(link, ctx):
+    if link.url is None or ctx.is_downloaded(link.key):
+        return []
+
+    strtime  = datetime.fromtimestamp(int(link.date)).strftime("%Y_%m_%d__%H_%M_%S")
+    strname  = f"LINK_{strtime}_{filename_rm_invalid_symbols(link.title)}"
+    filepath = ctx.get_free_filepath(os.path.join(ctx.folder_full_path, strname), 'jpg')
 
-    first_frames_arr = video.get('first_frame')
-    if first_frames_arr is not None:
-        best_first_frame = find_best_resolution(first_frames_arr)
-        raw_data = requests.get(best_first_frame['url']).content
-        with open(f"{filepath}.jpg", 'wb') as handler:
-            handler.write(raw_data)
+    return [DownloadJob(link.key, link.url, filepath, PRIORITY_LOW)]
 
 
-def process_message(msg, chat_folder_full_path, urls_downloaded):
+def parse_history_item(item):
     """
-    Documentation:
-    https://dev.vk.com/ru/reference/objects/attachments-message
+    Raw messages are converted right after they are received, videos are parsed
+    only when they are exported because they keep the whole raw message
     """
-    for attach in msg['attachments']:
-        if attach['type'] == 'photo':
-            process_photo(attach['photo'], chat_folder_full_path, urls_downloaded)
-        if attach['type'] == 'doc':
-            process_doc  (attach['doc'],   chat_folder_full_path, urls_downloaded)
-        if attach['type'] == 'video' and get_cvar('process_video', False):
-            process_video(attach['video'], chat_folder_full_path, urls_downloaded, msg)
-
-    for fwd_msg in msg.get('fwd_messages', []):
-        process_message(fwd_msg, chat_folder_full_path, urls_downloaded)
-
-
-def check_need_process_conversation(vk, conv_obj):
-    peer_id     = conv_obj['conversation']['peer']['id']
-    peer_type   = conv_obj['conversation']['peer']['type']
-    chat_title  = ''
-    if peer_type == 'user':
-        # should use 'profiles' from getConversations methon instead
-        users_data = vk.users.get(
-            user_ids=peer_id
-        )
-        chat_title  = f"user {peer_id} ({users_data[0]['first_name']} {users_data[0]['last_name']})"
-    elif peer_type == 'chat':
-        chat_title  = f"chat {peer_id} ({conv_obj['conversation']['chat_settings']['title']})"
-    elif peer_type == 'group':
-        chat_title  = f"group {peer_id} (groups are not supported)"
+    return parse_message(item, types=get_attachment_types(), size_policy=get_size_policy())
+
+
+def resolve_page_videos(vk, items, ctx):
+    """
+    Messages don't contain links to the video files, they are requested
+    for the whole page at once before the page is processed
+    """
+    if 'video' not in get_attachment_types():
+        return
+    videos = [
+        attach for msg in items for attach in msg.attachments
+        if attach.TYPE == 'video' and attach.files is None and not ctx.is_downloaded(attach.key)
+    ]
+    if len(videos) == 0:
+        return
+    try:
+        resolve_video_files(vk, videos)
+    except ApiError as e:
+        # only the previews of the videos are saved then
+        print(f"failed to get video files: {e}")
+
+
+def process_message(msg, ctx):
+    """
+    `msg` is a messages.Message, attachments of forwarded messages are already flattened
+    """
+    for attach in msg.attachments:
+        handler = get_attachment_handler(attach.TYPE)
+        if handler is None:
+            continue
+        for job in handler(attach, ctx):
+            ctx.download(job)
+
+
+def check_need_process_conversation(conversation):
+    if conversation.peer_type == 'group':
         return False
-    else:
-        chat_title  = f"{peer_type} {peer_id} ({peer_type}s are not supported)"
 
-    # get count of chat messages
-    chat_attachments : dict = vk.messages.getHistory(
-        offset=0,
-        count=1,
-        peer_id=peer_id
+    return query_yes_no(
+        f"Do you want to process {conversation.title} with {conversation.messages_count} messages?"
     )
-    total_count_messages = chat_attachments['count']
-    return query_yes_no(f"Do you want to process {chat_title} with {total_count_messages} messages?")
-
-
-def process_conversation(vk, conv_obj):
-    peer_id     = conv_obj['conversation']['peer']['id']
-    peer_type   = conv_obj['conversation']['peer']['type']
-    chat_folder = ''
-    if peer_type == 'user':
-        # should use 'profiles' from getConversations methon instead
-        users_data = vk.users.get(
-            user_ids=peer_id
-        )
-        chat_folder = f"{peer_id}_{users_data[0]['first_name']}_{users_data[0]['last_name']}"
-    elif peer_type == 'chat':
-        chat_folder = f"{peer_id}_{conv_obj['conversation']['chat_settings']['title']}"
-    elif peer_type == 'group':
-        chat_folder = f"{peer_id}_group"
-    else:
-        chat_folder = f"{peer_id}_{peer_type}"
-    chat_folder = filename_rm_invalid_symbols(chat_folder)
-
-    # get count of chat messages
-    chat_attachments : dict = vk.messages.getHistory(
-        offset=0,
-        count=1,
-        peer_id=peer_id
-    )
-    total_count_messages = chat_attachments['count']   
+
+
+def process_conversation(vk, conversation, download_pool, attachment_index, blob_store = None):
+    peer_id     = conversation.peer_id
+    chat_folder = filename_rm_invalid_symbols(conversation.folder_name)
+
+    total_count_messages  = conversation.messages_count
     chat_folder_full_path = os.path.join('output', chat_folder)
 
     print(f"current folder: {chat_folder}, messages to process: {total_count_messages}")
     
-    if os.path.exists(chat_folder_full_path):
-        shutil.rmtree(chat_folder_full_path)
     os.makedirs(chat_folder_full_path, exist_ok=True)
 
-    urls_downloaded = []
+    state = ExportState(chat_folder_full_path)
+    ctx   = ChatContext(chat_folder_full_path, download_pool, state, attachment_index, blob_store)
+
+    try:
+        can_sync = state.is_history_complete() and state.get_newest_message_id() is not None
+        if can_sync and get_cvar('incremental_sync', True):
+            sync_new_messages(vk, peer_id, ctx)
+        else:
+            export_history(vk, peer_id, ctx)
+    finally:
+        # after a failed request the downloads of the unfinished page still write to the state
+        wait(ctx.pop_page_futures())
+        state.close()
+    print(f"peer_id {peer_id}: downloads finished")
+
+
+
+def export_history(vk, peer_id, ctx):
+    """
+    Walks the whole history from the newest message to the oldest one
+    """
+    state  = ctx.state
+    cursor = HistoryCursor(state.set_resume_message_id)
 
-    all_messages_loaded = False
     processed_count_messages = 0
-    last_message_id = -1
-    MESSAGES_COUNT_PER_REQUEST = 200 # max 200
-    while(not all_messages_loaded):
-        chat_attachments : dict = vk.messages.getHistory(
-            offset=0,
-            count=MESSAGES_COUNT_PER_REQUEST,
-            peer_id=peer_id,
-            start_message_id=last_message_id
-        )
-        chat_attachments_items = chat_attachments['items']
+    last_message_id = state.get_resume_message_id()
+    if last_message_id != -1:
+        print(f"peer_id {peer_id}: resuming export from message {last_message_id}")
+    state.set_history_complete(False)
+
+    history_pages = iter_history_pages(
+        vk,
+        peer_id,
+        last_message_id,
+        get_cvar('history_calls_per_execute', MAX_CALLS_PER_EXECUTE),
+        parse=parse_history_item,
+        stream=get_cvar('history_streaming', True)
+    )
+    history_prefetch = get_cvar('history_prefetch', 1)
+    if history_prefetch > 0:
+        # the next page is requested while the current one is being processed
+        history_pages = prefetch_iter(history_pages, history_prefetch)
+    try:
+        for items, total_count_messages, page_last_message_id in history_pages:
+            if last_message_id == -1:
+                state.set_newest_message_id(items[0].id)
+
+            resolve_page_videos(vk, items, ctx)
+            for item in items:
+                process_message(item, ctx)
+                processed_count_messages += 1
+
+            last_message_id = page_last_message_id
+            cursor.add_page(last_message_id, ctx.pop_page_futures())
 
-        total_count_messages = chat_attachments['count']
-        for item in chat_attachments_items:
-            if item['id'] == last_message_id:
-                continue
-            process_message(item, chat_folder_full_path, urls_downloaded)
-            processed_count_messages += 1
+            if total_count_messages is not None:
+                print(f"peer_id {peer_id}: messages processed: {processed_count_messages} of {total_count_messages}")
+            else:
+                print(f"peer_id {peer_id}: messages processed: {processed_count_messages}")
+    finally:
+        # history is fetched while downloads are running, wait for the rest of them,
+        # also when a history request failed, the finished pages are saved then
+        finished = cursor.wait_finished()
+
+    if finished:
+        state.set_history_complete(True)
+    else:
+        # the history is walked again from the failed page on the next run
+        print(f"peer_id {peer_id}: some downloads failed, they will be retried on the next run")
 
-        last_message_id = chat_attachments_items[-1]['id']
-        all_messages_loaded = (len(chat_attachments_items) < MESSAGES_COUNT_PER_REQUEST)
 
-        print(f"peer_id {peer_id}: messages processed: {processed_count_messages} of {total_count_messages}")
+def sync_new_messages(vk, peer_id, ctx):
+    """
+    Fetches only messages newer than the last export.
+    Negative offset makes getHistory return messages after start_message_id.
+    """
+    state  = ctx.state
+    cursor = HistoryCursor(state.set_newest_message_id)
+
+    newest_message_id = state.get_newest_message_id()
+    print(f"peer_id {peer_id}: syncing messages newer than {newest_message_id}")
+
+    processed_count_messages = 0
+    try:
+        while True:
+            chat_attachments : dict = vk.messages.getHistory(
+                offset=-MESSAGES_COUNT_PER_REQUEST,
+                count=MESSAGES_COUNT_PER_REQUEST,
+                peer_id=peer_id,
+                start_message_id=newest_message_id
+            )
+            chat_attachments_items = [
+                parse_history_item(item) for item in chat_attachments['items'] if item['id'] > newest_message_id
+            ]
+            page_size = len(chat_attachments['items'])
+            chat_attachments = None
+            if len(chat_attachments_items) == 0:
+                break
+
+            resolve_page_videos(vk, chat_attachments_items, ctx)
+            # items are sorted from the newest to the oldest one
+            for item in reversed(chat_attachments_items):
+                process_message(item, ctx)
+                processed_count_messages += 1
+
+            newest_message_id = chat_attachments_items[0].id
+            cursor.add_page(newest_message_id, ctx.pop_page_futures())
+
+            print(f"peer_id {peer_id}: new messages processed: {processed_count_messages}")
+
+            if page_size < MESSAGES_COUNT_PER_REQUEST:
+                break
+    finally:
+        finished = cursor.wait_finished()
+
+    if not finished:
+        # newest_message_id stays before the failed page, it is synced again on the next run
+        print(f"peer_id {peer_id}: some downloads failed, they will be retried on the next run")
+
+
+def export_conversations(vk_session, conversations_to_process, download_pool, attachment_index, blob_store):
+    """
+    Exports up to `max_parallel_conversations` conversations at once.
+    API calls of all conversations share the session rate limit in FIFO order,
+    attachment downloads of all of them go to the same download pool.
+    """
+    max_parallel_conversations = max(1, get_cvar('max_parallel_conversations', 1))
+    # the session rate limiter lets requests overlap, one in flight per conversation
+    vk = FairVkApi(vk_session, FairGate(max_in_flight=max_parallel_conversations)).get_api()
+    total_count_conversations = len(conversations_to_process)
+    finished_count_conversations = 0
+    progress_lock = threading.Lock()
+
+    def export(idx, conversation):
+        nonlocal finished_count_conversations
+        peer_id = conversation.peer_id
+        print(f"processing conversation {idx + 1} of {total_count_conversations}")
+        try:
+            process_conversation(vk, conversation, download_pool, attachment_index, blob_store)
+        except Exception as e:
+            # the export state is saved, so the conversation is resumed on the next run
+            print(f"peer_id {peer_id}: export failed: {e}")
+        with progress_lock:
+            finished_count_conversations += 1
+            print(f"conversations finished: {finished_count_conversations} of {total_count_conversations}")
+            print(format_download_stats(download_pool))
+
+    with ThreadPoolExecutor(max_workers=max_parallel_conversations) as executor:
+        for idx, conversation in enumerate(conversations_to_process):
+            executor.submit(export, idx, conversation)
 
 
 def main():
@@ -295,12 +679,29 @@ def main():
     if password is None:
         password = input("Enter password: ")
 
+    # the exporter only reads, so its execute calls are safe to repeat
+    api_retry_policy = VkRetryPolicy(
+        max_attempts=get_cvar('api_retries', 5) + 1,
+        deadline=get_cvar('retry_deadline', 300),
+        idempotent_methods={'execute'},
+        breaker_threshold=get_cvar('circuit_breaker_threshold', 5),
+        breaker_timeout=get_cvar('circuit_breaker_reset', 30)
+    )
+
+    api_cache = None
+    if get_cvar('api_cache', True):
+        os.makedirs('output', exist_ok=True)
+        api_cache = VkApiCache(filename=os.path.join('output', API_CACHE_FILE_NAME))
+
     vk_session = vk_api.VkApi(
         login=login, 
         password=password,
         app_id=get_cvar('app_id'),
         auth_handler=auth_handler,
-        captcha_handler=captcha_handler
+        captcha_handler=captcha_handler,
+        retry_policy=api_retry_policy,
+        timeout=(10, get_cvar('request_timeout', 60)),
+        cache=api_cache
     )
 
     try:
@@ -314,51 +715,74 @@ def main():
 
     vk = vk_session.get_api()
 
-    # get count of chat messages
-    conversations : dict = vk.messages.getConversations(
-        offset=0,
-        count=1
-    )
-    total_count_conversations = conversations['count']
-    CONVERSATIONS_COUNT_PER_REQUEST = 100 # max 200
-
     peer_ids_to_process = get_cvar('peer_ids_to_process', [])
 
-    offset = 0
+    # names come with the conversations (extended=1), message counts are
+    # requested in batches of 25 conversations per execute
+    profile_cache = ProfileCache()
+    total_count_conversations    = 0
     prepared_count_conversations = 0
-    conversations_to_process = []
-    while offset < total_count_conversations:
-        conversations : dict = vk.messages.getConversations(
-            offset=offset,
-            count=CONVERSATIONS_COUNT_PER_REQUEST
-        )
-        offset += CONVERSATIONS_COUNT_PER_REQUEST
-
-        if conversations.get('items') is None:
-            return
-        
-        for conv_obj in conversations.get('items'):
-            prepared_count_conversations += 1
+    conversations_to_process     = []
+    for conversations, total_count_conversations in iter_conversation_pages(vk, profile_cache):
+        prepared_count_conversations += len(conversations)
+        if len(peer_ids_to_process) > 0:
+            conversations = [
+                conversation for conversation in conversations if conversation.peer_id in peer_ids_to_process
+            ]
+        else:
+            conversations = [
+                conversation for conversation in conversations if conversation.peer_type != 'group'
+            ]
+        load_messages_counts(vk, conversations)
+
+        for conversation in conversations:
             if len(peer_ids_to_process) == 0:
-                if not check_need_process_conversation(vk, conv_obj):
+                if not check_need_process_conversation(conversation):
                     continue
-            else:
-                peerId = conv_obj['conversation']['peer']['id']
-                if peerId not in peer_ids_to_process:
-                    continue
-            conversations_to_process.append(conv_obj)
+            conversations_to_process.append(conversation)
     
     print(f"conversations prepared: {prepared_count_conversations} of {total_count_conversations}")
     print(f"conversations to process: {len(conversations_to_process)}")
 
     print(f"peer ids: {len(conversations_to_process)}")
-    for conv_obj in conversations_to_process:
-        print(conv_obj['conversation']['peer']['id'])
+    for conversation in conversations_to_process:
+        print(conversation.peer_id)
         
 
-    for idx, conv_obj in enumerate(conversations_to_process):
-        print(f"processing conversation {idx + 1} of {len(conversations_to_process)}")
-        process_conversation(vk, conv_obj)
+    download_workers = get_cvar('download_workers', 4)
+    # retries are made by the policy, so the transfers interrupted in the middle
+    # of the body are repeated as well
+    download_session = create_download_session(pool_size=download_workers, max_retries=0)
+    download_retry_policy = VkRetryPolicy(
+        max_attempts=get_cvar('download_retries', 3) + 1,
+        backoff_base=get_cvar('download_retry_backoff', 0.5),
+        deadline=get_cvar('retry_deadline', 300),
+        breaker_threshold=get_cvar('circuit_breaker_threshold', 5),
+        breaker_timeout=get_cvar('circuit_breaker_reset', 30)
+    )
+    attachment_index_filepath = None
+    if get_cvar('attachment_index_persist', True):
+        os.makedirs('output', exist_ok=True)
+        attachment_index_filepath = os.path.join('output', ATTACHMENT_INDEX_FILE_NAME)
+    attachment_index = AttachmentIndex(attachment_index_filepath)
+
+    blob_store = None
+    if get_cvar('blob_store', False):
+        blob_store = BlobStore(
+            os.path.join('output', BLOB_STORE_FOLDER_NAME),
+            link_mode=get_cvar('blob_link', 'hardlink')
+        )
+
+    with DownloadPool(
+        workers=download_workers, session=download_session, retry_policy=download_retry_policy
+    ) as download_pool:
+        export_conversations(vk_session, conversations_to_process, download_pool, attachment_index, blob_store)
+
+    attachment_index.close()
+
+    if api_cache is not None:
+        api_cache.save()
+        print(f"api cache hits: {api_cache.stats['hits']}, misses: {api_cache.stats['misses']}")
     
 
 if __name__ == '__main__':
@@ -0,0 +1,168 @@
+from photo_sizes import DEFAULT_SIZE_POLICY
+
+
+# Attachment types parsed when the caller doesn't pass its own set.
+# wall - attachments of the reposted wall posts
+DEFAULT_ATTACHMENT_TYPES = frozenset({'photo', 'doc', 'audio_message', 'graffiti', 'wall'})
+
+
+def attachment_key(attach_type, attach):
+    """
+    Stable identity of an attachment, e.g. photo123_456.
+    Download urls are signed and expire, and access_key differs between
+    conversations, so neither of them can identify a forwarded attachment.
+    """
+    return f"{attach_type}{attach['owner_id']}_{attach['id']}"
+
+
+class PhotoAttachment:
+    TYPE = 'photo'
+    __slots__ = ('key', 'date', 'url')
+
+    def __init__(self, photo, message, size_policy = DEFAULT_SIZE_POLICY):
+        self.key  = attachment_key('photo', photo)
+        self.date = photo['date']
+        self.url  = size_policy.select_url(photo.get('sizes', []), photo.get('orig_photo'))
+
+
+class DocAttachment:
+    TYPE = 'doc'
+    __slots__ = ('key', 'date', 'url', 'preview_url', 'title', 'ext', 'type', 'size')
+
+    def __init__(self, doc, message, size_policy = DEFAULT_SIZE_POLICY):
+        preview_sizes    = doc.get('preview', {}).get('photo', {}).get('sizes', [])
+        self.key         = attachment_key('doc', doc)
+        self.date        = doc['date']
+        self.url         = doc.get('url')
+        self.preview_url = size_policy.select_url(preview_sizes)
+        self.title       = doc['title']
+        self.ext         = doc['ext']
+        self.type        = doc['type']
+        self.size        = doc.get('size')
+
+
+class VideoAttachment:
+    """
+    Videos are dumped to json as is, so the raw objects of the video
+    and of the message that holds it are kept.
+    `files` - links to the video files (mp4_720, hls, ...), messages don't have them,
+    they are requested with video.get, see video_download.resolve_video_files
+    """
+    TYPE = 'video'
+    __slots__ = ('key', 'date', 'title', 'first_frame_url', 'files', 'raw', 'message')
+
+    def __init__(self, video, message, size_policy = DEFAULT_SIZE_POLICY):
+        # first_frame is missing for some videos, the cover (image) is used instead
+        frames               = video.get('first_frame') or video.get('image') or []
+        self.key             = attachment_key('video', video)
+        self.date            = message['date']
+        self.title           = video.get('title', '')
+        self.first_frame_url = size_policy.select_url(frames)
+        self.files           = video.get('files')
+        self.raw             = video
+        self.message         = message
+
+
+class AudioMessageAttachment:
+    TYPE = 'audio_message'
+    __slots__ = ('key', 'date', 'url', 'ext')
+
+    def __init__(self, audio_message, message, size_policy = DEFAULT_SIZE_POLICY):
+        self.key  = attachment_key('audio_message', audio_message)
+        self.date = message['date']
+        if audio_message.get('link_mp3'):
+            self.url = audio_message['link_mp3']
+            self.ext = 'mp3'
+        else:
+            self.url = audio_message.get('link_ogg')
+            self.ext = 'ogg'
+
+
+class StickerAttachment:
+    """
+    The same sticker is sent many times, it is saved once per conversation
+    """
+    TYPE = 'sticker'
+    __slots__ = ('key', 'sticker_id', 'url')
+
+    def __init__(self, sticker, message, size_policy = DEFAULT_SIZE_POLICY):
+        self.key        = f"sticker{sticker['sticker_id']}"
+        self.sticker_id = sticker['sticker_id']
+        self.url        = size_policy.select_url(sticker.get('images') or [])
+
+
+class GraffitiAttachment:
+    TYPE = 'graffiti'
+    __slots__ = ('key', 'date', 'url')
+
+    def __init__(self, graffiti, message, size_policy = DEFAULT_SIZE_POLICY):
+        self.key  = attachment_key('graffiti', graffiti)
+        self.date = message['date']
+        self.url  = graffiti.get('url')
+
+
+class LinkAttachment:
+    """
+    Only the preview photo of a link is saved
+    """
+    TYPE = 'link'
+    __slots__ = ('key', 'date', 'url', 'title')
+
+    def __init__(self, link, message, size_policy = DEFAULT_SIZE_POLICY):
+        photo      = link.get('photo')
+        self.key   = attachment_key('link', photo) if photo else None
+        self.date  = photo.get('date', message['date']) if photo else message['date']
+        self.url   = size_policy.select_url(photo.get('sizes', [])) if photo else None
+        self.title = link.get('title', '')
+
+
+ATTACHMENT_MODELS = {
+    model.TYPE: model for model in (
+        PhotoAttachment, DocAttachment, VideoAttachment, AudioMessageAttachment,
+        StickerAttachment, GraffitiAttachment, LinkAttachment
+    )
+}
+
+
+class Message:
+    """
+    Only the fields the exporter needs. Attachments of forwarded messages
+    are flattened into `attachments`, so the raw page with its nested
+    fwd_messages trees and all photo sizes can be freed right after parsing.
+    """
+    __slots__ = ('id', 'date', 'attachments')
+
+    def __init__(self, message_id, date, attachments):
+        self.id          = message_id
+        self.date        = date
+        self.attachments = attachments
+
+
+def parse_attachments(msg, attachments, types = DEFAULT_ATTACHMENT_TYPES, size_policy = DEFAULT_SIZE_POLICY):
+    """
+    `msg` is a message or a wall post, attachments of forwarded messages
+    and of reposted posts are added too. Documentation:
+    https://dev.vk.com/ru/reference/objects/attachments-message
+    """
+    for attach in msg.get('attachments', []):
+        attach_type = attach['type']
+        if attach_type not in types:
+            continue
+        if attach_type == 'wall':
+            parse_attachments(attach['wall'], attachments, types, size_policy)
+            continue
+        model = ATTACHMENT_MODELS.get(attach_type)
+        if model is not None:
+            attachments.append(model(attach[attach_type], msg, size_policy))
+
+    for fwd_msg in msg.get('fwd_messages', []):
+        parse_attachments(fwd_msg, attachments, types, size_policy)
+
+    for post in msg.get('copy_history', []):
+        parse_attachments(post, attachments, types, size_policy)
+
+    return attachments
+
+
+def parse_message(msg, types = DEFAULT_ATTACHMENT_TYPES, size_policy = DEFAULT_SIZE_POLICY):
+    return Message(msg['id'], msg['date'], parse_attachments(msg, [], types, size_policy))
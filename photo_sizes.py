@@ -0,0 +1,97 @@
+"""
+Choosing one of the sizes of an image: photo sizes, document previews and video frames.
+Documentation:
+https://dev.vk.com/ru/reference/objects/photo-sizes
+"""
+
+
+# Size types from the smallest to the largest one with the max side (in px) of each of them.
+# o, p, q, r are crops of the smaller sizes, they are ranked by their max side too.
+SIZE_TYPES = (
+    ('s', 75),
+    ('m', 130),
+    ('o', 130),
+    ('p', 200),
+    ('q', 320),
+    ('r', 510),
+    ('x', 604),
+    ('y', 807),
+    ('z', 1080),
+    ('w', 2560),
+)
+
+SIZE_TYPE_RANK     = {size_type: rank for rank, (size_type, _) in enumerate(SIZE_TYPES)}
+SIZE_TYPE_MAX_SIDE = dict(SIZE_TYPES)
+
+SIZE_TARGET_LARGEST  = 'largest'
+SIZE_TARGET_ORIGINAL = 'original'
+
+
+def size_url(size):
+    """
+    Photo sizes and video frames keep the link in `url`, document previews in `src`
+    """
+    return size.get('url') or size.get('src')
+
+
+def size_sort_key(size):
+    """
+    Real dimensions are used when they are known, old photos have width and height 0,
+    for them the max side is taken from the size type
+    """
+    size_type = size.get('type')
+    side      = max(size.get('width') or 0, size.get('height') or 0)
+    if side == 0:
+        side = SIZE_TYPE_MAX_SIDE.get(size_type, 0)
+    return side, SIZE_TYPE_RANK.get(size_type, -1)
+
+
+class SizePolicy:
+    """
+    Which size of an image to download:
+    largest  - the largest available size
+    original - the original photo (orig_photo) if the API returns it, the largest size otherwise
+    N        - the largest size whose max side fits into N px, the smallest one if none fits
+    """
+    __slots__ = ('target', 'max_side')
+
+    def __init__(self, target = SIZE_TARGET_LARGEST):
+        self.max_side = None
+        if isinstance(target, int) or str(target).isdigit():
+            self.max_side = int(target)
+            target        = 'max'
+        elif target not in (SIZE_TARGET_LARGEST, SIZE_TARGET_ORIGINAL):
+            raise ValueError(f"Unknown photo size target: {target}")
+        self.target = target
+
+    def select(self, sizes, original = None):
+        """
+        Returns the chosen entry of `sizes` (or `original`), None if there are no sizes
+        """
+        if self.target == SIZE_TARGET_ORIGINAL and original and size_url(original):
+            return original
+
+        best     = None
+        best_key = None
+        smallest     = None
+        smallest_key = None
+        for size in sizes:
+            key = size_sort_key(size)
+            if self.max_side is not None:
+                if smallest is None or key < smallest_key:
+                    smallest     = size
+                    smallest_key = key
+                if key[0] > self.max_side:
+                    continue
+            if best is None or key > best_key:
+                best     = size
+                best_key = key
+
+        return best if best is not None else smallest
+
+    def select_url(self, sizes, original = None):
+        size = self.select(sizes, original)
+        return size_url(size) if size is not None else None
+
+
+DEFAULT_SIZE_POLICY = SizePolicy()
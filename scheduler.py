@@ -0,0 +1,65 @@
+import threading
+
+from collections import deque
+
+from common.vk_api.vk_api.vk_api import VkApiMethod
+
+
+class FairGate:
+    """
+    FIFO semaphore: threads pass in the order they arrived.
+    threading.Lock gives no ordering guarantees, so with several conversations
+    exported at once one of them could take the whole API budget.
+    """
+
+    def __init__(self, max_in_flight = 1):
+        self.lock      = threading.Lock()
+        self.waiters   = deque()
+        self.available = max_in_flight
+
+    def acquire(self):
+        with self.lock:
+            if self.available > 0 and not self.waiters:
+                self.available -= 1
+                return
+            event = threading.Event()
+            self.waiters.append(event)
+        # the slot is handed over by release() before the event is set
+        event.wait()
+
+    def release(self):
+        with self.lock:
+            if self.waiters:
+                self.waiters.popleft().set()
+            else:
+                self.available += 1
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class FairVkApi:
+    """
+    Passes API calls of concurrently exported conversations to the session
+    through a shared FairGate, so they split the rate limit evenly
+    """
+
+    def __init__(self, vk_session, gate):
+        self.vk_session = vk_session
+        self.gate       = gate
+
+    def method(self, method, values = None, **kwargs):
+        with self.gate:
+            return self.vk_session.method(method, values, **kwargs)
+
+    def method_stream(self, method, values = None, **kwargs):
+        # the request is sent under the gate, the body is read after it is released
+        with self.gate:
+            return self.vk_session.method_stream(method, values, **kwargs)
+
+    def get_api(self):
+        return VkApiMethod(self)
@@ -0,0 +1,230 @@
+import os
+
+import pytest
+import requests
+
+from downloader import DownloadPool
+from video_download import (
+    VideoFetch, VideoUnavailable, download_range, load_hls_segments, select_video_file, submit_parts
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code = 200, body = b'', text = '', drop_after = None, headers = None):
+        self.status_code = status_code
+        self.body        = body
+        self.text        = text
+        self.drop_after  = drop_after
+        self.headers     = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(response=self)
+
+    def iter_content(self, chunk_size):
+        body = self.body if self.drop_after is None else self.body[:self.drop_after]
+        for i in range(0, len(body), chunk_size):
+            yield body[i:i + chunk_size]
+        if self.drop_after is not None:
+            raise requests.exceptions.ChunkedEncodingError('connection dropped')
+
+
+class RangeSession:
+    """ Serves `data` with Range support, the first response is cut after `drop_after` bytes """
+
+    def __init__(self, data, drop_after = None):
+        self.data       = data
+        self.drop_after = drop_after
+        self.ranges     = []
+
+    def get(self, url, headers, stream, timeout):
+        start, _, end = headers['Range'][len('bytes='):].partition('-')
+        self.ranges.append((int(start), int(end)))
+        drop_after, self.drop_after = self.drop_after, None
+        return FakeResponse(206, self.data[int(start):int(end) + 1], drop_after=drop_after)
+
+
+class PlaylistSession:
+    def __init__(self, playlists):
+        self.playlists = playlists
+        self.requested = []
+
+    def get(self, url, timeout = None, **kwargs):
+        self.requested.append(url)
+        return FakeResponse(text=self.playlists[url])
+
+
+class NoRetry:
+    """ VkRetryPolicy without the breaker: retries every dropped connection at once """
+
+    def call(self, fn, url, idempotent=True):
+        for attempt in range(5):
+            try:
+                return fn()
+            except requests.exceptions.ChunkedEncodingError:
+                if attempt == 4:
+                    raise
+
+
+def test_select_video_file():
+    files = {'mp4_360': 'u360', 'mp4_720': 'u720', 'mp4_1080': 'u1080', 'hls': 'uhls'}
+
+    assert select_video_file(files) == ('mp4', 'u1080')
+    assert select_video_file(files, 720) == ('mp4', 'u720')
+    assert select_video_file(files, 500) == ('mp4', 'u360')
+    # the worst quality when none of them fits
+    assert select_video_file(files, 144) == ('mp4', 'u360')
+
+    assert select_video_file({'hls': 'uhls', 'mp4_480': ''}) == ('hls', 'uhls')
+    assert select_video_file({'external': 'https://youtube.com/'}) is None
+    assert select_video_file({}) is None
+
+
+def test_load_hls_segments_master():
+    session = PlaylistSession({
+        'https://vk.test/video/master.m3u8': '\n'.join([
+            '#EXTM3U',
+            '#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360,CODECS="avc1.4d401e,mp4a.40.2"',
+            '360/index.m3u8',
+            '#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"',
+            '720/index.m3u8',
+            '#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1920x1080,CODECS="avc1.640028,mp4a.40.2"',
+            '1080/index.m3u8',
+        ]),
+        'https://vk.test/video/720/index.m3u8': '\n'.join([
+            '#EXTM3U',
+            '#EXT-X-TARGETDURATION:4',
+            '#EXTINF:4.0,',
+            'seg0.ts',
+            '#EXTINF:4.0,',
+            'https://cdn.vk.test/seg1.ts',
+            '#EXT-X-ENDLIST',
+        ]),
+    })
+
+    segments = load_hls_segments(session, 'https://vk.test/video/master.m3u8', 720)
+
+    assert segments == ['https://vk.test/video/720/seg0.ts', 'https://cdn.vk.test/seg1.ts']
+    assert session.requested[-1] == 'https://vk.test/video/720/index.m3u8'
+
+
+def test_load_hls_segments_fmp4():
+    session = PlaylistSession({
+        'https://vk.test/v.m3u8': '#EXTM3U\n#EXT-X-MAP:URI="init.mp4"\n#EXTINF:4.0,\nseg0.m4s\n',
+    })
+
+    assert load_hls_segments(session, 'https://vk.test/v.m3u8') == [
+        'https://vk.test/init.mp4', 'https://vk.test/seg0.m4s'
+    ]
+
+
+def test_load_hls_segments_unsupported():
+    session = PlaylistSession({
+        'https://vk.test/enc.m3u8': '#EXTM3U\n#EXT-X-KEY:METHOD=AES-128,URI="key"\n#EXTINF:4.0,\nseg0.ts\n',
+        'https://vk.test/empty.m3u8': '#EXTM3U\n#EXT-X-ENDLIST\n',
+    })
+
+    with pytest.raises(ValueError):
+        load_hls_segments(session, 'https://vk.test/enc.m3u8')
+    with pytest.raises(ValueError):
+        load_hls_segments(session, 'https://vk.test/empty.m3u8')
+
+
+def test_download_range_continues_segment(tmp_path):
+    data     = bytes(range(256)) * 4
+    filepath = str(tmp_path / 'seg')
+    with open(filepath, 'wb') as f:
+        f.write(data[100:150])
+    session = RangeSession(data, drop_after=30)
+
+    download_range(session, 'https://vk.test/v.mp4', filepath, 100, 499, chunk_size=16, retry_policy=NoRetry())
+
+    with open(filepath, 'rb') as f:
+        assert f.read() == data[100:500]
+    # the partial file is continued, the dropped transfer is continued after its last chunk
+    assert session.ranges == [(150, 499), (180, 499)]
+
+
+def test_download_range_ignored_range(tmp_path):
+    class IgnoringSession:
+        def get(self, url, headers, stream, timeout):
+            return FakeResponse(200, b'whole file')
+
+    with pytest.raises(IOError):
+        download_range(IgnoringSession(), 'https://vk.test/v.mp4', str(tmp_path / 'seg'), 0, 9)
+
+
+def test_submit_parts(tmp_path):
+    filepath = str(tmp_path / 'video.mp4')
+    chunks   = [bytes([i]) * (i + 1) for i in range(10)]
+
+    def write_part(part_filepath, data):
+        with open(part_filepath, 'wb') as f:
+            f.write(data)
+
+    parts = [
+        (f"{filepath}.seg{i:04d}", lambda part_filepath, data=data: write_part(part_filepath, data))
+        for i, data in enumerate(chunks)
+    ]
+    with DownloadPool(workers=3, max_pending=2) as pool:
+        submit_parts(pool, parts, filepath).result(timeout=10)
+
+    with open(filepath, 'rb') as f:
+        assert f.read() == b''.join(chunks)
+    assert os.listdir(str(tmp_path)) == ['video.mp4']
+
+
+def test_submit_parts_failed(tmp_path):
+    filepath = str(tmp_path / 'video.mp4')
+
+    def fetch(part_filepath):
+        if part_filepath.endswith('1'):
+            raise IOError('part failed')
+        with open(part_filepath, 'wb') as f:
+            f.write(b'data')
+
+    parts = [(f"{filepath}.seg{i:04d}", fetch) for i in range(3)]
+    with DownloadPool(workers=2) as pool:
+        result = submit_parts(pool, parts, filepath)
+        with pytest.raises(IOError):
+            result.result(timeout=10)
+
+    # finished parts are kept for the next run
+    assert sorted(os.listdir(str(tmp_path))) == ['video.mp4.seg0000', 'video.mp4.seg0002']
+
+
+def test_video_fetch_queues_parts_from_worker(tmp_path):
+    """ The resolve job queues the segments from a worker, it must not block on a full pool """
+    segments = {f"https://vk.test/seg{i}.ts": bytes([i]) * 8 for i in range(12)}
+    playlist = '#EXTM3U\n' + ''.join(f"#EXTINF:4.0,\n{url}\n" for url in segments)
+
+    class HlsSession(PlaylistSession):
+        def get(self, url, timeout = None, stream = False, **kwargs):
+            if url in segments:
+                return FakeResponse(body=segments[url])
+            return super().get(url, timeout)
+
+    filepath = str(tmp_path / 'video.ts')
+    session  = HlsSession({'https://vk.test/v.m3u8': playlist})
+    with DownloadPool(workers=1, max_pending=1, session=session) as pool:
+        VideoFetch(session, 'hls', 'https://vk.test/v.m3u8').submit(pool, filepath).result(timeout=10)
+
+    with open(filepath, 'rb') as f:
+        assert f.read() == b''.join(segments.values())
+
+
+def test_video_fetch_unavailable(tmp_path):
+    session = PlaylistSession({'https://vk.test/enc.m3u8': '#EXTM3U\n#EXT-X-KEY:METHOD=AES-128,URI="k"\nseg0.ts\n'})
+    filepath = str(tmp_path / 'video.ts')
+    with DownloadPool(workers=1, session=session) as pool:
+        result = VideoFetch(session, 'hls', 'https://vk.test/enc.m3u8').submit(pool, filepath)
+        with pytest.raises(VideoUnavailable):
+            result.result(timeout=10)
+
+    assert not os.path.exists(filepath)
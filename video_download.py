@@ -0,0 +1,330 @@
+import os
+import re
+import requests
+import shutil
+import threading
+
+from concurrent.futures import Future
+from urllib.parse import urljoin
+
+from downloader import DEFAULT_CHUNK_SIZE, DEFAULT_DOWNLOAD_TIMEOUT, download_file
+from messages import attachment_key
+
+
+# Heights of the mp4_* files returned by video.get, from the best quality to the worst one
+VIDEO_QUALITIES = (2160, 1440, 1080, 720, 480, 360, 240, 144)
+
+VIDEO_IDS_PER_REQUEST = 200 # max 200
+
+DEFAULT_SEGMENT_SIZE = 8 * 1024 * 1024
+
+
+class VideoUnavailable(Exception):
+    """
+    The video file can't be downloaded (encrypted or empty stream),
+    the job is replaced with its fallback, see DownloadJob
+    """
+
+def video_full_id(video):
+    """
+    owner_id_id_access_key, videos of other users can be requested only with the access key
+    """
+    full_id = f"{video['owner_id']}_{video['id']}"
+    if video.get('access_key'):
+        full_id += f"_{video['access_key']}"
+    return full_id
+
+
+def resolve_video_files(vk, videos):
+    """
+    Sets `files` of the VideoAttachment objects, one video.get call per VIDEO_IDS_PER_REQUEST videos.
+    Documentation:
+    https://dev.vk.com/ru/method/video.get
+    """
+    for i in range(0, len(videos), VIDEO_IDS_PER_REQUEST):
+        chunk    = videos[i:i + VIDEO_IDS_PER_REQUEST]
+        response = vk.video.get(videos=','.join(video_full_id(video.raw) for video in chunk), count=len(chunk))
+        files    = {attachment_key('video', item): item.get('files') or {} for item in response['items']}
+        for video in chunk:
+            # deleted or private videos are missing in the response
+            video.files = files.get(video.key, {})
+
+
+def select_video_file(files, max_height = None):
+    """
+    Returns ('mp4', url) of the best quality not higher than `max_height`,
+    ('hls', url) if the video is available only as a stream, None for external videos (YouTube, ...)
+    """
+    mp4_files = [(height, files[f"mp4_{height}"]) for height in VIDEO_QUALITIES if files.get(f"mp4_{height}")]
+    if mp4_files:
+        fitting = [item for item in mp4_files if max_height is None or item[0] <= max_height]
+        # the worst quality if none of them fits
+        return 'mp4', (fitting[0] if fitting else mp4_files[-1])[1]
+    if files.get('hls'):
+        return 'hls', files['hls']
+    return None
+
+
+def probe_range_support(session, url, timeout = DEFAULT_DOWNLOAD_TIMEOUT):
+    """
+    Returns the size of the file if the server accepts Range requests, None otherwise
+    """
+    with session.head(url, allow_redirects=True, timeout=timeout) as response:
+        response.raise_for_status()
+        if response.headers.get('Accept-Ranges', '').lower() != 'bytes':
+            return None
+        size = response.headers.get('Content-Length')
+        return int(size) if size and size.isdigit() else None
+
+
+def download_range(session, url, filepath, start, end, chunk_size = DEFAULT_CHUNK_SIZE, retry_policy = None,
+                   timeout = DEFAULT_DOWNLOAD_TIMEOUT):
+    """
+    Downloads bytes start..end (inclusive) of `url` to `filepath`. A partially downloaded
+    segment is continued from its end, including retries of a transfer dropped in the middle
+    """
+    expected_size = end - start + 1
+
+    def fetch():
+        done_size = os.path.getsize(filepath) if os.path.isfile(filepath) else 0
+        if done_size >= expected_size:
+            if done_size > expected_size:
+                os.remove(filepath)
+                done_size = 0
+            else:
+                return None
+        headers = {'Range': f"bytes={start + done_size}-{end}"}
+        with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise IOError(f"server ignored the range request: {url}")
+            with open(filepath, 'ab') as handler:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    handler.write(chunk)
+        if os.path.getsize(filepath) != expected_size:
+            # retried like a dropped connection, the next attempt continues the segment
+            raise requests.exceptions.ChunkedEncodingError(f"segment {start}-{end} is incomplete: {url}")
+        return response
+
+    if retry_policy is None:
+        fetch()
+    else:
+        retry_policy.call(fetch, url)
+
+
+def assemble_parts(part_filepaths, filepath):
+    tmp_filepath = filepath + '.part'
+    try:
+        with open(tmp_filepath, 'wb') as handler:
+            for part_filepath in part_filepaths:
+                with open(part_filepath, 'rb') as part:
+                    shutil.copyfileobj(part, handler)
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        if os.path.isfile(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
+    for part_filepath in part_filepaths:
+        os.remove(part_filepath)
+
+
+def submit_parts(download_pool, parts, filepath, priority = 0, size_hint = None):
+    """
+    Queues every part as a separate pool job, `parts` is a list of (part_filepath, fetch),
+    fetch(part_filepath) downloads one part. The parts are joined into `filepath` by the
+    worker that finishes the last of them, so no worker waits for the others.
+    Parts of a failed download are kept and continued on the next run.
+    Returns a future that is resolved once the file is assembled.
+    """
+    result = Future()
+    result.set_running_or_notify_cancel()
+    lock      = threading.Lock()
+    remaining = len(parts)
+    errors    = []
+
+    def on_part_done(f):
+        nonlocal remaining
+        with lock:
+            remaining -= 1
+            if f.exception() is not None:
+                errors.append(f.exception())
+            if remaining > 0:
+                return
+        if errors:
+            result.set_exception(errors[0])
+            return
+        try:
+            assemble_parts([part_filepath for part_filepath, _ in parts], filepath)
+            result.set_result(None)
+        except Exception as e:
+            result.set_exception(e)
+
+    for part_filepath, fetch in parts:
+        download_pool.submit(fetch, part_filepath, priority=priority, size_hint=size_hint).add_done_callback(on_part_done)
+    return result
+
+
+class RangedFetch:
+    """
+    Downloads a file in `segment_size` segments with parallel HTTP Range requests
+    """
+
+    def __init__(self, session, url, size, segment_size = DEFAULT_SEGMENT_SIZE, chunk_size = DEFAULT_CHUNK_SIZE,
+                 retry_policy = None, timeout = DEFAULT_DOWNLOAD_TIMEOUT):
+        self.session      = session
+        self.url          = url
+        self.size         = size
+        self.segment_size = segment_size
+        self.chunk_size   = chunk_size
+        self.retry_policy = retry_policy
+        self.timeout      = timeout
+
+    def submit(self, download_pool, filepath, priority = 0):
+        parts = []
+        for i, start in enumerate(range(0, self.size, self.segment_size)):
+            end = min(start + self.segment_size, self.size) - 1
+            fetch = lambda part_filepath, start=start, end=end: download_range(
+                self.session, self.url, part_filepath, start, end, self.chunk_size, self.retry_policy, self.timeout
+            )
+            parts.append((f"{filepath}.seg{i:04d}", fetch))
+        return submit_parts(download_pool, parts, filepath, priority, self.segment_size)
+
+
+class HlsFetch:
+    """
+    Downloads the segments of an HLS media playlist and joins them into one file
+    """
+
+    def __init__(self, session, segment_urls, chunk_size = DEFAULT_CHUNK_SIZE, retry_policy = None,
+                 timeout = DEFAULT_DOWNLOAD_TIMEOUT):
+        self.session      = session
+        self.segment_urls = segment_urls
+        self.chunk_size   = chunk_size
+        self.retry_policy = retry_policy
+        self.timeout      = timeout
+
+    def fetch_segment(self, url, part_filepath):
+        # segments are saved under the final name only when they are complete
+        if not os.path.isfile(part_filepath):
+            download_file(self.session, url, part_filepath, self.chunk_size, self.retry_policy, self.timeout)
+
+    def submit(self, download_pool, filepath, priority = 0):
+        parts = [
+            (f"{filepath}.seg{i:05d}", lambda part_filepath, url=url: self.fetch_segment(url, part_filepath))
+            for i, url in enumerate(self.segment_urls)
+        ]
+        return submit_parts(download_pool, parts, filepath, priority)
+
+
+HLS_ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_hls_attributes(line):
+    return {name: value.strip('"') for name, value in HLS_ATTRIBUTE_RE.findall(line.split(':', 1)[1])}
+
+
+def load_hls_segments(session, url, max_height = None, timeout = DEFAULT_DOWNLOAD_TIMEOUT):
+    """
+    Returns the segment urls. For a master playlist the best variant not higher
+    than `max_height` is chosen. Fragmented mp4 streams start with their init section,
+    the joined segments are played like a .ts file. Encrypted streams are not supported
+    """
+    with session.get(url, timeout=timeout) as response:
+        response.raise_for_status()
+        lines = [line.strip() for line in response.text.splitlines() if line.strip()]
+
+    if any(line.startswith('#EXT-X-STREAM-INF') for line in lines):
+        variants = []
+        for i, line in enumerate(lines[:-1]):
+            if line.startswith('#EXT-X-STREAM-INF'):
+                attributes = parse_hls_attributes(line)
+                resolution = attributes.get('RESOLUTION', '0x0').lower().partition('x')
+                height     = int(resolution[2]) if resolution[2].isdigit() else 0
+                bandwidth  = int(attributes.get('BANDWIDTH', '0') or 0)
+                variants.append((height, bandwidth, urljoin(url, lines[i + 1])))
+        fitting = [variant for variant in variants if max_height is None or variant[0] <= max_height]
+        variant = max(fitting) if fitting else min(variants)
+        return load_hls_segments(session, variant[2], max_height, timeout)
+
+    segment_urls = []
+    for line in lines:
+        if line.startswith('#EXT-X-KEY') and parse_hls_attributes(line).get('METHOD', 'NONE') != 'NONE':
+            raise ValueError(f"encrypted HLS streams are not supported: {url}")
+        if line.startswith('#EXT-X-MAP'):
+            # fragmented mp4: the init section goes before the segments
+            segment_urls.append(urljoin(url, parse_hls_attributes(line)['URI']))
+        elif not line.startswith('#'):
+            segment_urls.append(urljoin(url, line))
+    if not segment_urls:
+        raise ValueError(f"HLS playlist has no segments: {url}")
+    return segment_urls
+
+
+class VideoFetch:
+    """
+    Resolves the video file in a pool job, so the history walker never waits for it:
+    the playlists of an HLS stream are loaded, a large mp4 file is probed for Range support.
+    The same job queues the segments or downloads a small file by itself.
+    Streams that can't be downloaded (encrypted, no segments) fail with VideoUnavailable
+    """
+
+    def __init__(self, session, kind, url, max_height = None, segment_size = DEFAULT_SEGMENT_SIZE,
+                 chunk_size = DEFAULT_CHUNK_SIZE, retry_policy = None, timeout = DEFAULT_DOWNLOAD_TIMEOUT):
+        self.session      = session
+        self.kind         = kind
+        self.url          = url
+        self.max_height   = max_height
+        self.segment_size = segment_size
+        self.chunk_size   = chunk_size
+        self.retry_policy = retry_policy
+        self.timeout      = timeout
+
+    def request(self, fn, *args):
+        if self.retry_policy is None:
+            return fn(*args)
+        return self.retry_policy.call(lambda: fn(*args), self.url)
+
+    def resolve(self):
+        """
+        Returns the fetcher of the parts, None if the file is downloaded by one request
+        """
+        if self.kind == 'hls':
+            segment_urls = self.request(load_hls_segments, self.session, self.url, self.max_height, self.timeout)
+            return HlsFetch(self.session, segment_urls, self.chunk_size, self.retry_policy, self.timeout)
+
+        size = self.request(probe_range_support, self.session, self.url, self.timeout)
+        if size is None or size <= self.segment_size:
+            return None
+        return RangedFetch(self.session, self.url, size, self.segment_size, self.chunk_size, self.retry_policy,
+                           self.timeout)
+
+    def start(self, download_pool, filepath, priority):
+        try:
+            fetcher = self.resolve()
+        except ValueError as e:
+            raise VideoUnavailable(str(e)) from e
+        if fetcher is None:
+            download_file(self.session, self.url, filepath, self.chunk_size, self.retry_policy, self.timeout)
+            return None
+        return fetcher.submit(download_pool, filepath, priority)
+
+    def submit(self, download_pool, filepath, priority = 0):
+        result = Future()
+        result.set_running_or_notify_cancel()
+
+        def on_parts_done(f):
+            if f.exception() is not None:
+                result.set_exception(f.exception())
+            else:
+                result.set_result(None)
+
+        def on_started(f):
+            if f.exception() is not None:
+                result.set_exception(f.exception())
+            elif f.result() is None:
+                result.set_result(None)
+            else:
+                f.result().add_done_callback(on_parts_done)
+
+        download_pool.submit(self.start, download_pool, filepath, priority, priority=priority).add_done_callback(on_started)
+        return result